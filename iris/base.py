@@ -7,6 +7,13 @@ class ItemTypePlugin(object):
     name = None
     form_class = None
 
+    # The content type of the items this plugin adds, as "app_label.model".
+    content_type = None
+
+    # Bump this when the view template of `content_type` changes, so that
+    # cached renderings of existing items are discarded.
+    view_version = 1
+
     @property
     def action_label(self):
         # Set this as an attribute of a subclass to turn off this behavior.
@@ -20,6 +27,20 @@ class ItemTypePlugin(object):
     def add_template(self):
         return 'iris/items/{0}.html'.format(self.name)
 
+    def serialize(self, obj):
+        """Return a dict of JSON-serializable values describing an item's content.
+
+        Override this in subclasses to expose the fields of `content_type`.
+        """
+        return dict(text=unicode(obj))
+
+    def search_text(self, obj):
+        """Return the text to index for searching an item's content, or None.
+
+        By default, content is not searchable.
+        """
+        return None
+
     def user_has_perm(self, topic, user):
         """Returns whether or not a user has a named permission for a topic.
 
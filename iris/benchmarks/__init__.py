@@ -0,0 +1,245 @@
+"""Reproducible benchmarks of the iris views and queries.
+
+`seed` fills the database with synthetic topics, participants and items;
+``manage.py iris_benchmark_seed`` runs it.  `run` times each scenario and
+returns a JSON-serializable report of wall time, query count and the
+process's peak memory, along with the startup times measured by `startup`;
+``manage.py iris_benchmark`` writes it to a baseline file that can be
+diffed between runs.
+
+Seeding needs ``iris.example`` in INSTALLED_APPS for its Note and OneLiner
+content types.  Scenarios act as the first seeded user, who is a superuser
+so that every view is allowed.
+"""
+import datetime
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import time
+
+import django
+from django.conf import settings as django_settings
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection, reset_queries
+from django.test.client import RequestFactory
+
+from iris import views
+from iris.models import Item, Topic
+from iris.perms import PermissionCacheMiddleware
+
+
+USERNAME_PREFIX = 'bench'
+SUBJECT_PREFIX = 'Benchmark topic'
+
+WORDS = (
+    'aardvark badger camel dingo eland ferret gecko heron ibex jackal koala lemur '
+    'marmot newt ocelot panda quail raven stoat tapir urchin vole walrus yak zebu'
+).split()
+
+
+def seed(topics=10, items=100, participants=5, random_seed=0):
+    """Create `topics` topics of `items` items each, shared by `participants` users.
+
+    Items alternate between notes and one-liners, created a minute apart,
+    by random participants.  The same arguments always produce the same
+    data.  Returns the topics created.
+    """
+    if 'iris.example' not in django_settings.INSTALLED_APPS:
+        raise ImproperlyConfigured('Seeding benchmarks needs iris.example in INSTALLED_APPS.')
+    from iris.example.models import Note, OneLiner
+    rng = random.Random(random_seed)
+    users = []
+    for i in range(max(participants, 1)):
+        user, created = User.objects.get_or_create(username='{0}{1}'.format(USERNAME_PREFIX, i))
+        if i == 0 and not user.is_superuser:
+            user.is_superuser = True
+            user.save()
+        users.append(user)
+    start = datetime.datetime.now() - datetime.timedelta(minutes=topics * items)
+    created_topics = []
+    for t in range(topics):
+        topic = Topic(subject='{0} {1}'.format(SUBJECT_PREFIX, t), creator=users[0])
+        topic.save()
+        topic.add_participants(creator=users[0], objs=users)
+        # Content and items are created in bulk, then the topic is recounted
+        # and touched once.
+        contents = []
+        for i in range(items):
+            text = ' '.join(rng.choice(WORDS) for word in range(rng.randint(3, 30)))
+            if i % 2:
+                contents.append(OneLiner(quip=text[:160]))
+            else:
+                contents.append(Note(text=text))
+        for model in (Note, OneLiner):
+            batch = [content for content in contents if isinstance(content, model)]
+            model.objects.bulk_create(batch)
+            ids = list(model.objects.order_by('-id').values_list('id', flat=True)[:len(batch)])
+            for content, content_id in zip(batch, reversed(ids)):
+                content.id = content_id
+        Item.objects.bulk_create([
+            Item(
+                topic=topic,
+                created=start + datetime.timedelta(minutes=t * items + i),
+                creator=rng.choice(users),
+                content=content,
+            )
+            for i, content in enumerate(contents)
+        ])
+        if contents:
+            Topic.objects.recount([topic.id])
+            topic.add_unread(None, len(contents))
+            topic.touch(start + datetime.timedelta(minutes=(t + 1) * items))
+        created_topics.append(topic)
+    return created_topics
+
+
+class Scenario(object):
+    """A named request or query, run repeatedly against the seeded data.
+
+    Set `writes` for scenarios that change the data; `run` runs them after
+    the others, so that they do not skew them.
+    """
+
+    def __init__(self, name, function, writes=False):
+        self.name = name
+        self.function = function
+        self.writes = writes
+
+    def __call__(self, state):
+        return self.function(state)
+
+
+def _view(view, method='get', anonymous=False, data=None, path='/', **kwargs):
+    def run(state):
+        factory = RequestFactory()
+        request = getattr(factory, method)(path, data or {})
+        request.user = AnonymousUser() if anonymous else state['user']
+        response = view(request, **dict((key, value(state)) for key, value in kwargs.items()))
+        # As at the end of every request.
+        PermissionCacheMiddleware().process_response(request, response)
+        if hasattr(response, 'render'):
+            response.render()
+        return response
+    return run
+
+
+def _with_participant(state):
+    return list(Topic.objects.with_participant(state['user']))
+
+
+SCENARIOS = (
+    Scenario('topic', _view(views.topic, topic_id=lambda state: state['topic'].id)),
+    Scenario('topics', _view(views.topics)),
+    Scenario('topics_anonymous', _view(views.topics, anonymous=True)),
+    Scenario('items_after', _view(
+        views.items_after,
+        topic_id=lambda state: state['topic'].id,
+        after_item_id=lambda state: state['after_item'].id,
+    )),
+    Scenario('item_add', _view(
+        views.item_add,
+        method='post',
+        data=dict(text='A benchmark note.'),
+        topic_id=lambda state: state['topic'].id,
+        plugin_name=lambda state: 'example.note.add',
+    ), writes=True),
+    Scenario('with_participant', _with_participant),
+)
+
+
+def _process_peak_rss():
+    # The peak of the whole process so far, not of any one scenario.
+    # Kilobytes on Linux, bytes on Mac OS X; only comparable on one platform.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+# Run in a fresh interpreter by `startup`.  Django's own settings are
+# loaded first, so that only iris is timed.
+STARTUP_SCRIPT = """
+import time
+from django.conf import settings
+settings.INSTALLED_APPS
+started = time.time()
+from iris.conf import settings
+imported = time.time()
+list(settings.ITEM_TYPE_PLUGINS)
+print (imported - started) * 1000, (time.time() - imported) * 1000
+"""
+
+
+def startup(repeat=5):
+    """Time importing the iris settings, then loading the item type plugins, in fresh processes.
+
+    Returns the best of `repeat` runs of each, in milliseconds.  The
+    settings are those of this process.
+    """
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(path for path in sys.path if path))
+    timings = []
+    for i in range(repeat):
+        output = subprocess.check_output([sys.executable, '-c', STARTUP_SCRIPT], env=env)
+        timings.append([float(value) for value in output.split()])
+    return dict(
+        import_settings_ms=round(min(imported for imported, loaded in timings), 3),
+        load_plugins_ms=round(min(loaded for imported, loaded in timings), 3),
+    )
+
+
+def run(repeat=10, scenarios=None, startup_repeat=5):
+    """Run each scenario `repeat` times after one warm-up run, returning a report.
+
+    Times are in milliseconds.  Queries are those of the last run.
+    ``process_peak_rss`` is the peak resident memory of the whole process
+    up to the end of the scenario.  It never goes down, so it only shows
+    which scenario, if any, raised the peak.  Scenarios that write run
+    last.  Startup is timed `startup_repeat` times; pass 0 to skip it.
+    """
+    user = User.objects.get(username='{0}0'.format(USERNAME_PREFIX))
+    topic = Topic.objects.filter(subject__startswith=SUBJECT_PREFIX).order_by('-id')[0]
+    items = list(topic.items.order_by('-id').values_list('id', flat=True)[:10])
+    state = dict(
+        user=user,
+        topic=topic,
+        after_item=Item.objects.get(pk=items[-1]),
+    )
+    report = dict(
+        environment=dict(
+            python=platform.python_version(),
+            django=django.get_version(),
+            database=connection.vendor,
+            topics=Topic.objects.count(),
+            items=Item.objects.count(),
+            repeat=repeat,
+        ),
+        scenarios={},
+    )
+    if startup_repeat:
+        report['startup'] = startup(startup_repeat)
+    use_debug_cursor = connection.use_debug_cursor
+    connection.use_debug_cursor = True
+    try:
+        # sorted() is stable, so scenarios keep their order otherwise.
+        for scenario in sorted(scenarios or SCENARIOS, key=lambda scenario: scenario.writes):
+            cache.clear()
+            scenario(state)
+            timings = []
+            for i in range(repeat):
+                reset_queries()
+                started = time.time()
+                scenario(state)
+                timings.append((time.time() - started) * 1000)
+            report['scenarios'][scenario.name] = dict(
+                min_ms=round(min(timings), 3),
+                mean_ms=round(sum(timings) / len(timings), 3),
+                max_ms=round(max(timings), 3),
+                queries=len(connection.queries),
+                process_peak_rss=_process_peak_rss(),
+            )
+    finally:
+        connection.use_debug_cursor = use_debug_cursor
+        reset_queries()
+    return report
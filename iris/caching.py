@@ -0,0 +1,82 @@
+"""Cached iris data, kept in the Django cache."""
+import time
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.utils import translation
+
+from iris.conf import settings
+
+
+# The first page of "Latest topics" is the same for every user in each of
+# these groups, so it is cached once per group.
+TOPICS_ALL_KEY = 'iris.topics.all'
+TOPICS_ANONYMOUS_KEY = 'iris.topics.anonymous'
+
+
+def topics_cache_key(user):
+    """Return the key of the first page of topics as seen by `user`.
+
+    Returns None when the page depends on the individual user's
+    permissions and is not cached.
+    """
+    if user.is_active and user.is_superuser:
+        return TOPICS_ALL_KEY
+    if user.is_anonymous():
+        return TOPICS_ANONYMOUS_KEY
+    return None
+
+
+def invalidate_topics():
+    """Forget the cached first pages of topics."""
+    cache.delete_many([TOPICS_ALL_KEY, TOPICS_ANONYMOUS_KEY])
+
+
+def roster_cache_key(topic_id):
+    """Return the key of the current participant roster of a topic.
+
+    The key includes a generation that `invalidate_roster` bumps, so a
+    roster read before a join or leave and cached after it is never used.
+    """
+    generation_key = _roster_generation_key(topic_id)
+    generation = cache.get(generation_key)
+    if generation is None:
+        # Start from the clock, so that rosters cached under a generation
+        # that has since expired are not picked up again.
+        cache.add(generation_key, int(time.time() * 1000000), settings.ROSTER_CACHE_TIMEOUT)
+        generation = cache.get(generation_key)
+    return 'iris.roster.{0}.{1}'.format(topic_id, generation)
+
+
+def invalidate_roster(topic_id):
+    """Forget the cached participant roster of a topic."""
+    invalidate_rosters([topic_id])
+
+
+def invalidate_rosters(topic_ids):
+    """Forget the cached participant rosters of many topics."""
+    for topic_id in topic_ids:
+        try:
+            cache.incr(_roster_generation_key(topic_id))
+        except ValueError:
+            # Without a generation there is no current roster to forget.
+            pass
+
+
+def _roster_generation_key(topic_id):
+    return 'iris.roster.{0}.generation'.format(topic_id)
+
+
+def item_fragment_key(item):
+    """Return the key of the cached rendering of `item`.
+
+    The key changes with the `view_version` of the plugin that adds the
+    item's content type, and with the active language.
+    """
+    content_type = ContentType.objects.get_for_id(item.content_type_id)
+    name = '{0}.{1}'.format(content_type.app_label, content_type.model)
+    version = max([
+        plugin.view_version for plugin in settings.ITEM_TYPE_PLUGINS
+        if plugin.content_type == name
+    ] or [0])
+    return 'iris.item.{0}.{1}.{2}.{3}'.format(item.id, name, version, translation.get_language())
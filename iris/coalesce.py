@@ -0,0 +1,131 @@
+"""Coalesced updates of Topic.modified and the topic counts for busy topics.
+
+When ``IRIS_COALESCE_TOPIC_MODIFIED`` is on, Item.save records the latest
+item timestamp of each topic here, along with the items and participants
+to add to its counts, instead of updating the topic row.  A background
+thread writes the buffered changes every
+``IRIS_COALESCE_TOPIC_MODIFIED_INTERVAL`` seconds, and once more when the
+process exits, so concurrent posters no longer serialize on the topic's
+row lock.
+"""
+import atexit
+import logging
+import threading
+
+from django.db import connection, transaction
+
+from iris.caching import invalidate_topics
+from iris.conf import settings
+
+
+logger = logging.getLogger('iris.coalesce')
+
+
+class ModifiedBuffer(object):
+    """Latest item timestamps and count deltas per topic, waiting to be written."""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._thread = None
+        self._stopped = threading.Event()
+
+    def record(self, topic_id, modified, items=0, participants=0, since_item_id=None):
+        """Remember that `topic_id` has an item created at `modified`.
+
+        `items`, `participants` and `since_item_id` are added up and passed
+        to `TopicManager.add_counts` by the next flush.  Record them only
+        once the transaction that added the items has been committed.
+        """
+        with self._lock:
+            self._merge(topic_id, (modified, items, participants, since_item_id))
+            if self._thread is None or not self._thread.is_alive():
+                # Started lazily so that forked workers each get their own.
+                self._thread = threading.Thread(target=self._run, name='iris-modified-flusher')
+                self._thread.daemon = True
+                self._thread.start()
+
+    def flush(self):
+        """Write all buffered timestamps and counts in one transaction.
+
+        Returns the number of topics updated.  On failure the changes are
+        put back so the next flush retries them.
+        """
+        from iris.models import Topic
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        try:
+            with transaction.commit_on_success():
+                # Sorted so that concurrent flushers take row locks in the same order.
+                for topic_id, (modified, items, participants, since_item_id) in sorted(pending.items()):
+                    if items or participants or since_item_id is not None:
+                        Topic.objects.touch(
+                            topic_id,
+                            modified,
+                            items=items,
+                            participants=participants,
+                            since_item_id=since_item_id,
+                        )
+                    else:
+                        Topic.objects.touch(topic_id, modified)
+        except Exception:
+            with self._lock:
+                for topic_id, change in pending.items():
+                    self._merge(topic_id, change)
+            raise
+        invalidate_topics()
+        return len(pending)
+
+    def discard_counts(self, topic_ids=None):
+        """Forget the buffered count deltas of `topic_ids`, or of every topic.
+
+        Called when the counts are rebuilt from scratch, which already
+        includes the items the deltas are for.
+        """
+        with self._lock:
+            for topic_id, (modified, items, participants, since_item_id) in self._pending.items():
+                if topic_ids is None or topic_id in topic_ids:
+                    self._pending[topic_id] = (modified, 0, 0, None)
+
+    def _merge(self, topic_id, change):
+        # Called with the lock held.
+        current = self._pending.get(topic_id)
+        if current is None:
+            self._pending[topic_id] = change
+            return
+        since_item_ids = [i for i in (current[3], change[3]) if i is not None]
+        self._pending[topic_id] = (
+            max(current[0], change[0]),
+            current[1] + change[1],
+            current[2] + change[2],
+            min(since_item_ids) if since_item_ids else None,
+        )
+
+    def stop(self, timeout=None):
+        """Stop the background thread and write anything still buffered.
+
+        Waits up to `timeout` seconds, by default one interval, for a flush
+        already under way in the thread to finish, so that it neither
+        races the final flush nor is cut off when the interpreter exits.
+        """
+        self._stopped.set()
+        thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(self.interval if timeout is None else timeout)
+        self.flush()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Could not flush coalesced topic timestamps.')
+            finally:
+                connection.close()
+
+
+modified_buffer = ModifiedBuffer(settings.COALESCE_TOPIC_MODIFIED_INTERVAL)
+atexit.register(modified_buffer.stop)
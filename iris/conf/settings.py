@@ -1,24 +1,95 @@
+import os
+
 from django.conf import settings
 from django.utils.importlib import import_module
 
+from iris.registry import PluginRegistry
+
 
 # The order in which "add item" forms appear in the UI.
 # Each item is in the the form of "module.name.ClassName"
 # e.g. "iris.plugins.ParticipantJoinPlugin"
-ITEM_TYPE_PLUGINS = getattr(settings, 'IRIS_ITEM_TYPE_PLUGINS', ())
-
-
-# Now load all of the plugins.
-ITEM_TYPE_PLUGINS_BY_NAME = {
-    # plugin_class.name: plugin_class,
-}
-_ITEM_TYPE_PLUGINS = []
-for name in ITEM_TYPE_PLUGINS:
-    modname, classname = name.rsplit('.', 1)
-    module = import_module(modname)
-    plugin_class = getattr(module, classname)
-    plugin = plugin_class()
-    ITEM_TYPE_PLUGINS_BY_NAME[plugin.name] = plugin
-    _ITEM_TYPE_PLUGINS.append(plugin)
-ITEM_TYPE_PLUGINS = tuple(_ITEM_TYPE_PLUGINS)
-del _ITEM_TYPE_PLUGINS
+# Plugins are imported on first use; see iris.registry.
+ITEM_TYPE_PLUGINS = PluginRegistry(getattr(settings, 'IRIS_ITEM_TYPE_PLUGINS', ()))
+ITEM_TYPE_PLUGINS_BY_NAME = ITEM_TYPE_PLUGINS.by_name
+
+
+# The number of items shown per page of a topic's timeline.
+ITEMS_PER_PAGE = getattr(settings, 'IRIS_ITEMS_PER_PAGE', 50)
+
+
+# Buffer Topic.modified updates in-process and write them in batches,
+# instead of updating the topic row on every item.
+COALESCE_TOPIC_MODIFIED = getattr(settings, 'IRIS_COALESCE_TOPIC_MODIFIED', False)
+
+# The longest time, in seconds, a buffered Topic.modified may stay unwritten.
+COALESCE_TOPIC_MODIFIED_INTERVAL = getattr(settings, 'IRIS_COALESCE_TOPIC_MODIFIED_INTERVAL', 2.0)
+
+
+# How long, in seconds, an item stream stays open before the client
+# reconnects, and how often a keep-alive is sent while it is idle.
+STREAM_TIMEOUT = getattr(settings, 'IRIS_STREAM_TIMEOUT', 55)
+STREAM_HEARTBEAT = getattr(settings, 'IRIS_STREAM_HEARTBEAT', 15)
+
+# How many topics the in-process item hub remembers the latest item of.
+STREAM_HUB_TOPICS = getattr(settings, 'IRIS_STREAM_HUB_TOPICS', 1000)
+
+
+# The transport that carries new-item events to receivers, and where
+# iris.events.RedisTransport finds its server.
+EVENT_TRANSPORT = getattr(settings, 'IRIS_EVENT_TRANSPORT', 'iris.events.LocalTransport')
+EVENT_REDIS_HOST = getattr(settings, 'IRIS_EVENT_REDIS_HOST', 'localhost')
+EVENT_REDIS_PORT = getattr(settings, 'IRIS_EVENT_REDIS_PORT', 6379)
+EVENT_REDIS_CHANNEL = getattr(settings, 'IRIS_EVENT_REDIS_CHANNEL', 'iris.events')
+
+
+# The number of topics shown per page of the topic list, and how long, in
+# seconds, its first page may be cached.
+TOPICS_PER_PAGE = getattr(settings, 'IRIS_TOPICS_PER_PAGE', 50)
+TOPICS_CACHE_TIMEOUT = getattr(settings, 'IRIS_TOPICS_CACHE_TIMEOUT', 300)
+
+# The most topics listed under "Your topics" by the topicsjoined filter.
+JOINED_TOPICS_LIMIT = getattr(settings, 'IRIS_JOINED_TOPICS_LIMIT', 50)
+
+
+# How long, in seconds, rendered items are kept in the Django cache.
+ITEM_FRAGMENT_CACHE_TIMEOUT = getattr(settings, 'IRIS_ITEM_FRAGMENT_CACHE_TIMEOUT', 60 * 60 * 24)
+
+
+# How long, in seconds, the participant roster of a topic may be cached.
+ROSTER_CACHE_TIMEOUT = getattr(settings, 'IRIS_ROSTER_CACHE_TIMEOUT', 60 * 60)
+
+
+# The number of rows written per statement by bulk operations such as
+# leaving many topics at once.
+BULK_BATCH_SIZE = getattr(settings, 'IRIS_BULK_BATCH_SIZE', 500)
+
+
+# The most topics and items handled by one call to the items_sync view.
+SYNC_MAX_TOPICS = getattr(settings, 'IRIS_SYNC_MAX_TOPICS', 200)
+SYNC_MAX_ITEMS = getattr(settings, 'IRIS_SYNC_MAX_ITEMS', 200)
+
+
+# The search index backend, and where iris.search.SQLiteSearchBackend keeps
+# its index: by default beside the settings module, so that the index does
+# not move with the working directory.
+SEARCH_BACKEND = getattr(settings, 'IRIS_SEARCH_BACKEND', 'iris.search.SQLiteSearchBackend')
+if getattr(settings, 'SETTINGS_MODULE', None):
+    _settings_dir = os.path.dirname(os.path.abspath(import_module(settings.SETTINGS_MODULE).__file__))
+else:
+    _settings_dir = os.getcwd()
+SEARCH_INDEX_PATH = getattr(settings, 'IRIS_SEARCH_INDEX_PATH', os.path.join(_settings_dir, 'iris_search.db'))
+
+
+# The age, in days, past which ``manage.py iris_archive`` moves items into
+# the archive table.
+ARCHIVE_AFTER_DAYS = getattr(settings, 'IRIS_ARCHIVE_AFTER_DAYS', 365)
+
+
+# Append the tags of recorded queries to their SQL as a comment; see
+# iris.instrumentation.
+QUERY_COMMENTS = getattr(settings, 'IRIS_QUERY_COMMENTS', settings.DEBUG)
+
+# Report the queries of each request in an X-Iris-Queries response header
+# when iris.instrumentation.QueryInstrumentationMiddleware is installed.
+QUERY_HEADER = getattr(settings, 'IRIS_QUERY_HEADER', settings.DEBUG)
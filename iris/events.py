@@ -0,0 +1,219 @@
+"""New-item events.
+
+`item_added` is sent once for every item added to a topic, with the
+`topic_id`, `item_id` and `content_type_id` of the item.  It is only sent
+once the transaction that created the item has committed.  Items created
+inside a managed transaction, e.g. under TransactionMiddleware, are queued
+until `flush()` is called; EventMiddleware does this at the end of each
+request.
+
+Events travel through the transport named by ``IRIS_EVENT_TRANSPORT``.
+LocalTransport delivers them within the current process.  RedisTransport
+relays them between processes through a Redis server, so receivers in
+every worker hear about items added by any other worker.
+
+Receivers should be connected with `connect()`, which also makes sure the
+transport is listening for events from other processes.
+"""
+import json
+import logging
+import socket
+import threading
+import time
+
+from django.db import transaction
+from django.dispatch import Signal
+from django.utils.importlib import import_module
+
+from iris.conf import settings
+
+
+logger = logging.getLogger('iris.events')
+
+item_added = Signal(providing_args=['topic_id', 'item_id', 'content_type_id'])
+
+
+def _dispatch(event):
+    from iris.models import Item
+    item_added.send(sender=Item, **event)
+
+
+class LocalTransport(object):
+    """Delivers events to receivers in this process only."""
+
+    def publish(self, event):
+        _dispatch(event)
+
+    def listen(self):
+        pass
+
+
+class RedisTransport(object):
+    """Relays events between processes through Redis PUBLISH and SUBSCRIBE.
+
+    It speaks the Redis protocol directly, so it needs no client library and
+    works with anything that implements those two commands.  Every process,
+    including the publishing one, receives events through its subscription.
+    """
+
+    def __init__(self, host=None, port=None, channel=None):
+        self.host = host or settings.EVENT_REDIS_HOST
+        self.port = port or settings.EVENT_REDIS_PORT
+        self.channel = channel or settings.EVENT_REDIS_CHANNEL
+        self._lock = threading.Lock()
+        self._socket = None
+        self._listener = None
+
+    def publish(self, event):
+        payload = json.dumps(event)
+        with self._lock:
+            try:
+                self._command('PUBLISH', self.channel, payload)
+            except socket.error:
+                # The connection may have gone stale; retry once on a new one.
+                self._close()
+                self._command('PUBLISH', self.channel, payload)
+
+    def listen(self):
+        with self._lock:
+            if self._listener is None or not self._listener.is_alive():
+                self._listener = threading.Thread(target=self._listen, name='iris-event-listener')
+                self._listener.daemon = True
+                self._listener.start()
+
+    def _command(self, *args):
+        if self._socket is None:
+            self._socket = socket.create_connection((self.host, self.port))
+            self._file = self._socket.makefile('rb')
+        self._socket.sendall(encode_command(*args))
+        return read_reply(self._file)
+
+    def _close(self):
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+
+    def _listen(self):
+        while True:
+            try:
+                sock = socket.create_connection((self.host, self.port))
+                try:
+                    sock.sendall(encode_command('SUBSCRIBE', self.channel))
+                    fp = sock.makefile('rb')
+                    while True:
+                        reply = read_reply(fp)
+                        if reply[0] == 'message':
+                            _dispatch(dict(
+                                (str(key), value)
+                                for key, value in json.loads(reply[2]).items()
+                            ))
+                finally:
+                    sock.close()
+            except Exception:
+                logger.exception('Lost subscription to %s:%s; reconnecting.', self.host, self.port)
+                time.sleep(1)
+
+
+def encode_command(*args):
+    """Encode a command in the Redis protocol."""
+    parts = ['*{0}\r\n'.format(len(args))]
+    for arg in args:
+        if isinstance(arg, unicode):
+            arg = arg.encode('utf-8')
+        parts.append('${0}\r\n{1}\r\n'.format(len(arg), arg))
+    return ''.join(parts)
+
+
+def read_reply(fp):
+    """Read one Redis protocol reply from a file object."""
+    line = fp.readline()
+    if not line:
+        raise socket.error('Connection closed.')
+    kind, rest = line[0], line[1:-2]
+    if kind == '+':
+        return rest
+    elif kind == '-':
+        raise socket.error(rest)
+    elif kind == ':':
+        return int(rest)
+    elif kind == '$':
+        length = int(rest)
+        if length == -1:
+            return None
+        data = fp.read(length + 2)
+        return data[:-2]
+    elif kind == '*':
+        return [read_reply(fp) for i in range(int(rest))]
+    raise socket.error('Unexpected reply {0!r}.'.format(line))
+
+
+_transport = None
+_pending = threading.local()
+
+
+def get_transport():
+    """Return the transport named by ``IRIS_EVENT_TRANSPORT``."""
+    global _transport
+    if _transport is None:
+        modname, classname = settings.EVENT_TRANSPORT.rsplit('.', 1)
+        _transport = getattr(import_module(modname), classname)()
+    return _transport
+
+
+def connect(receiver, **kwargs):
+    """Connect a receiver to `item_added` and start listening for events."""
+    item_added.connect(receiver, **kwargs)
+    get_transport().listen()
+
+
+def send_item_added(item):
+    """Send `item_added` for an item, once its transaction has committed."""
+    events = _pending_events()
+    events.append(dict(
+        topic_id=item.topic_id,
+        item_id=item.id,
+        content_type_id=item.content_type_id,
+    ))
+    if not transaction.is_managed():
+        flush()
+
+
+def flush():
+    """Send all events queued by this thread.
+
+    The items are already committed, so an event that cannot be sent, e.g.
+    while Redis is down, is logged and dropped rather than raised.
+    """
+    events = _pending_events()
+    while events:
+        event = events.pop(0)
+        try:
+            get_transport().publish(event)
+        except Exception:
+            logger.exception('Could not send event %r.', event)
+
+
+def discard():
+    """Forget events queued by this thread, e.g. after a rollback."""
+    del _pending_events()[:]
+
+
+def _pending_events():
+    if not hasattr(_pending, 'events'):
+        _pending.events = []
+    return _pending.events
+
+
+class EventMiddleware(object):
+    """Sends the events queued during a request once the request is done.
+
+    List it above TransactionMiddleware so that its response processing
+    happens after the transaction commits.
+    """
+
+    def process_response(self, request, response):
+        flush()
+        return response
+
+    def process_exception(self, request, exception):
+        discard()
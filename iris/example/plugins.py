@@ -16,8 +16,15 @@ class NoteAddPlugin(ItemTypePlugin):
 
     label = u'note'
     name = u'example.note.add'
+    content_type = 'example.note'
     form_class = NoteForm
 
+    def serialize(self, obj):
+        return dict(text=obj.text)
+
+    def search_text(self, obj):
+        return obj.text
+
 
 class OneLinerForm(ModelPluginForm):
 
@@ -29,4 +36,11 @@ class OneLinerAddPlugin(ItemTypePlugin):
 
     label = u'quip'
     name = u'example.oneliner.add'
+    content_type = 'example.oneliner'
     form_class = OneLinerForm
+
+    def serialize(self, obj):
+        return dict(quip=obj.quip)
+
+    def search_text(self, obj):
+        return obj.quip
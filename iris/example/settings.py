@@ -65,9 +65,12 @@ TEMPLATE_LOADERS = (
 )
 
 MIDDLEWARE_CLASSES = (
+    'iris.instrumentation.QueryInstrumentationMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'iris.events.EventMiddleware',
+    'iris.perms.PermissionCacheMiddleware',
 )
 
 if DEBUG:
@@ -90,6 +93,7 @@ AUTHENTICATION_BACKENDS = (
 
 IRIS_ITEM_TYPE_PLUGINS = (
     'iris.plugins.ParticipantAddUserPlugin',
+    'iris.plugins.ParticipantAddUsersPlugin',
     'iris.example.plugins.OneLinerAddPlugin',
     'iris.example.plugins.NoteAddPlugin',
 )
@@ -0,0 +1,82 @@
+"""Conditional request helpers.
+
+Pages are fingerprinted by what they show: the state of the topics, the
+permissions of the user looking at them and the installed item type
+plugins.  Matching conditional requests are answered with 304 before any
+forms are built or templates rendered.
+"""
+import hashlib
+import time
+
+from django.http import HttpResponseNotModified
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.utils.http import http_date, parse_etags, parse_http_date_safe, quote_etag
+
+from iris.conf import settings
+from iris.perms import has_perm
+
+
+def fingerprint(*parts):
+    """Return a short digest of `parts`, which must have a stable repr."""
+    return hashlib.md5(repr(parts)).hexdigest()
+
+
+def plugin_fingerprint():
+    """Return a value that changes with the installed item type plugins."""
+    return tuple((plugin.name, plugin.view_version) for plugin in settings.ITEM_TYPE_PLUGINS)
+
+
+def user_fingerprint(user, perms, obj=None):
+    """Return a value that changes with who `user` is and which of `perms` they have."""
+    return (user.id, user.is_authenticated()) + tuple(has_perm(user, perm, obj) for perm in perms)
+
+
+def etag_matches(request, etag):
+    """Return True if the request's If-None-Match header matches `etag`."""
+    header = request.META.get('HTTP_IF_NONE_MATCH')
+    if not header:
+        return False
+    etags = parse_etags(header)
+    return '*' in etags or etag in etags
+
+
+def is_not_modified(request, etag, last_modified=None):
+    """Return True if the client's copy matching `etag` or `last_modified` is current.
+
+    If-Modified-Since is only consulted without If-None-Match, and only
+    when `last_modified` is given.
+    """
+    if request.META.get('HTTP_IF_NONE_MATCH'):
+        return etag_matches(request, etag)
+    if last_modified is not None:
+        since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE'))
+        return since is not None and int(_timestamp(last_modified)) <= since
+    return False
+
+
+def not_modified(etag, last_modified=None):
+    """Return a 304 response carrying `etag`."""
+    return patch_conditional_headers(HttpResponseNotModified(), etag, last_modified)
+
+
+def patch_conditional_headers(response, etag, last_modified=None, public=False):
+    """Set ETag, Last-Modified and the caching headers for a conditional page.
+
+    `public` pages may be stored by shared caches, which must revalidate
+    them; other pages are private to the user.  Either way they vary by
+    cookie, since the session decides who the user is.
+    """
+    response['ETag'] = quote_etag(etag)
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(_timestamp(last_modified))
+    if public:
+        patch_cache_control(response, public=True, max_age=0, must_revalidate=True)
+    else:
+        patch_cache_control(response, private=True, max_age=0)
+    patch_vary_headers(response, ['Cookie'])
+    return response
+
+
+def _timestamp(value):
+    # Datetimes in iris are naive local times.
+    return time.mktime(value.timetuple())
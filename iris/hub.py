@@ -0,0 +1,76 @@
+"""In-process publish/subscribe of new items.
+
+The hub hears about each new item through iris.events once `start()` has
+been called, and the ``items_stream`` view waits on it, so that idle
+streaming clients cost no database queries.  The view starts the hub
+itself; call ``hub.start()`` at startup to track items from the first
+request on.  Items posted in other processes only reach the hub through
+a transport that relays between them, such as
+``iris.events.RedisTransport``.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from iris import events
+from iris.conf import settings
+
+
+class ItemHub(object):
+    """Tracks the latest item id of recently active topics and wakes up their waiters.
+
+    At most `size` topics are remembered, forgetting the least recently
+    updated first.  Waiters on a forgotten topic still wake for its next
+    item.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self._lock = threading.Lock()
+        self._latest = OrderedDict()
+        # Maps each topic with waiters to its condition and waiter count.
+        self._waiting = {}
+
+    def start(self):
+        """Start hearing about new items.  Calling it again does nothing."""
+        events.connect(_item_added, dispatch_uid='iris.hub')
+
+    def publish(self, topic_id, item_id):
+        """Announce that `topic_id` has a new item `item_id`."""
+        with self._lock:
+            latest = self._latest.pop(topic_id, 0)
+            self._latest[topic_id] = max(latest, item_id)
+            while len(self._latest) > self.size:
+                self._latest.popitem(last=False)
+            waiting = self._waiting.get(topic_id)
+            if waiting is not None:
+                waiting[0].notify_all()
+
+    def wait(self, topic_id, after_item_id, timeout):
+        """Wait up to `timeout` seconds for an item newer than `after_item_id`.
+
+        Returns the latest item id of the topic, or None on timeout.  Only
+        waiters on `topic_id` are woken by its new items.
+        """
+        deadline = time.time() + timeout
+        with self._lock:
+            waiting = self._waiting.setdefault(topic_id, [threading.Condition(self._lock), 0])
+            waiting[1] += 1
+            try:
+                while self._latest.get(topic_id, 0) <= after_item_id:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        return None
+                    waiting[0].wait(remaining)
+                return self._latest[topic_id]
+            finally:
+                waiting[1] -= 1
+                if not waiting[1]:
+                    del self._waiting[topic_id]
+
+
+hub = ItemHub(settings.STREAM_HUB_TOPICS)
+
+
+def _item_added(sender, topic_id, item_id, **kwargs):
+    hub.publish(topic_id, item_id)
@@ -0,0 +1,335 @@
+"""Counting and timing the SQL queries run by iris views and template tags.
+
+While queries are being recorded, every statement is timed and labelled
+with the stack of tags active when it ran.  Tags name the code that issued
+the query: QueryInstrumentationMiddleware tags each request with its view,
+e.g. ``iris.views.topic``, and the iris template tags and filters tag their
+own queries, e.g. ``iris_tags.itemfragments``.  Filters that return
+querysets are not tagged, since their queries run later, wherever the
+template iterates over them.  When ``IRIS_QUERY_COMMENTS`` is true the tags
+are also appended to the SQL as a comment, so they show up in the
+database's own logs.
+
+Record queries around any code with `record_queries`::
+
+    with record_queries() as log:
+        topic.add_item(creator=user, obj=note)
+    print log.count(), log.time()
+
+QueryInstrumentationMiddleware records each request, logs a summary to the
+``iris.queries`` logger, and, when ``IRIS_QUERY_HEADER`` is true, adds it to
+the response as an ``X-Iris-Queries`` header.  The recording of a streamed
+response goes on until its body has been sent.  QueryAssertionsMixin gives
+test cases `assertIrisQueries` to hold views to a query budget.
+
+Nothing is wrapped or timed while no recording is active.
+"""
+import logging
+import threading
+from contextlib import contextmanager
+from functools import wraps
+from time import time
+
+from django.db import connections
+
+from iris.conf import settings
+
+
+logger = logging.getLogger('iris.queries')
+
+HEADER = 'X-Iris-Queries'
+
+_state = threading.local()
+
+
+class Query(object):
+    """One statement: its SQL, its duration in seconds, and the tags active when it ran."""
+
+    def __init__(self, sql, duration, tags):
+        self.sql = sql
+        self.duration = duration
+        self.tags = tags
+
+    @property
+    def tag(self):
+        """The innermost tag, or None."""
+        return self.tags[-1] if self.tags else None
+
+
+class QueryLog(object):
+    """The queries run while a recording was active.
+
+    `tags` holds every tag entered during the recording, whether or not
+    queries ran under it.
+    """
+
+    def __init__(self):
+        self.queries = []
+        self.tags = set()
+
+    def _matching(self, tag):
+        if tag is None:
+            return self.queries
+        return [query for query in self.queries if tag in query.tags]
+
+    def count(self, tag=None):
+        """Return the number of queries run, or the number run under `tag`."""
+        return len(self._matching(tag))
+
+    def time(self, tag=None):
+        """Return the total duration in seconds of the queries run, or of those run under `tag`."""
+        return sum(query.duration for query in self._matching(tag))
+
+    def summary(self):
+        """Return ``(tag, count, time)`` for each innermost tag, most queries first.
+
+        Queries run under no tag are counted under None.
+        """
+        totals = {}
+        for query in self.queries:
+            count, duration = totals.get(query.tag, (0, 0.0))
+            totals[query.tag] = (count + 1, duration + query.duration)
+        return sorted(
+            ((tag, count, duration) for tag, (count, duration) in totals.items()),
+            key=lambda row: (-row[1], row[0]),
+        )
+
+    def format(self):
+        """Return the count, time in milliseconds and per-tag counts as one line."""
+        parts = ['count={0}'.format(self.count()), 'time={0:.3f}'.format(self.time() * 1000)]
+        parts.extend(
+            '{0}={1}'.format(tag, count)
+            for tag, count, duration in self.summary()
+            if tag is not None
+        )
+        return '; '.join(parts)
+
+
+def _tags():
+    if not hasattr(_state, 'tags'):
+        _state.tags = []
+    return _state.tags
+
+
+def _logs():
+    if not hasattr(_state, 'logs'):
+        _state.logs = []
+    return _state.logs
+
+
+def _comment(tags):
+    # Tags must neither close the comment nor look like parameter markers.
+    text = ' > '.join(tags).replace('*/', '').replace('%', '')
+    return ' /* {0} */'.format(text)
+
+
+class InstrumentedCursor(object):
+    """Wraps a Django cursor to tag and time its statements."""
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def __getattr__(self, attr):
+        return getattr(self.cursor, attr)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+    def execute(self, sql, params=()):
+        return self._run(self.cursor.execute, sql, params)
+
+    def executemany(self, sql, param_list):
+        return self._run(self.cursor.executemany, sql, param_list)
+
+    def _run(self, method, sql, params):
+        tags = tuple(_tags())
+        if tags and settings.QUERY_COMMENTS:
+            # Appended, since drivers such as sqlite3 look at the start of
+            # a statement to decide whether to begin a transaction.
+            sql = sql + _comment(tags)
+        start = time()
+        try:
+            return method(sql, params)
+        finally:
+            query = Query(sql, time() - start, tags)
+            for log in _logs():
+                log.queries.append(query)
+
+
+def _instrument(connection):
+    # Connections belong to one thread, so the cursor method of this
+    # connection alone is replaced until the recording stops.
+    if 'cursor' not in connection.__dict__:
+        cursor = connection.cursor
+        connection.cursor = lambda: InstrumentedCursor(cursor())
+
+
+def _uninstrument(connection):
+    connection.__dict__.pop('cursor', None)
+
+
+def start_recording():
+    """Start recording queries in this thread.  Returns the QueryLog they are added to.
+
+    Recordings may overlap; each query is added to every active log.
+    """
+    log = QueryLog()
+    log.depth = len(_tags())
+    logs = _logs()
+    if not logs:
+        for connection in connections.all():
+            _instrument(connection)
+    logs.append(log)
+    return log
+
+
+def stop_recording(log):
+    """Stop adding queries to `log`, and leave any tags entered since it started."""
+    logs = _logs()
+    if log in logs:
+        logs.remove(log)
+    del _tags()[log.depth:]
+    if not logs:
+        for connection in connections.all():
+            _uninstrument(connection)
+
+
+@contextmanager
+def record_queries():
+    """Record the queries run inside the block into the QueryLog it yields."""
+    log = start_recording()
+    try:
+        yield log
+    finally:
+        stop_recording(log)
+
+
+def enter_tag(tag):
+    _tags().append(tag)
+    for log in _logs():
+        log.tags.add(tag)
+
+
+def leave_tag(tag):
+    tags = _tags()
+    if tags and tags[-1] == tag:
+        tags.pop()
+
+
+class query_tag(object):
+    """Tag the queries run inside a block, or by a function, with `tag`.
+
+    Example::
+
+        @register.filter
+        @query_tag('iris_tags.canviewtopic')
+        def canviewtopic(user, topic):
+            ...
+    """
+
+    def __init__(self, tag):
+        self.tag = tag
+
+    def __enter__(self):
+        enter_tag(self.tag)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        leave_tag(self.tag)
+
+    def __call__(self, function):
+        @wraps(function)
+        def tagged(*args, **kwargs):
+            with self:
+                return function(*args, **kwargs)
+        # Lets template filters check their arguments, as with stringfilter.
+        tagged._decorated_function = getattr(function, '_decorated_function', function)
+        return tagged
+
+
+def view_tag(view):
+    """Return the tag of a view function: its module and name."""
+    return '{0}.{1}'.format(view.__module__, getattr(view, '__name__', view.__class__.__name__))
+
+
+class QueryInstrumentationMiddleware(object):
+    """Records and reports the queries run by each request.
+
+    List it first in MIDDLEWARE_CLASSES, so that it sees the queries of
+    the other middleware as well.
+    """
+
+    def process_request(self, request):
+        # A request whose response was never processed, e.g. because an
+        # exception propagated, would otherwise leave its recording, and
+        # the instrumented cursors, in place for good.
+        stale = getattr(_state, 'request_log', None)
+        if stale is not None:
+            self._finish(None, stale)
+        request.iris_queries = _state.request_log = start_recording()
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        enter_tag(view_tag(view_func))
+
+    def process_response(self, request, response):
+        log = getattr(request, 'iris_queries', None)
+        if log is None or log is not getattr(_state, 'request_log', None):
+            return response
+        if getattr(response, '_base_content_is_iter', False):
+            # The body has yet to run; keep recording until it is sent.
+            response._container = self._stream(request, response._container, log)
+            return response
+        summary = self._finish(request, log)
+        if settings.QUERY_HEADER:
+            response[HEADER] = summary
+        return response
+
+    def _stream(self, request, container, log):
+        try:
+            for chunk in container:
+                yield chunk
+        finally:
+            if hasattr(container, 'close'):
+                container.close()
+            self._finish(request, log)
+
+    def _finish(self, request, log):
+        # Stops the recording and logs its summary, which it returns.
+        if getattr(_state, 'request_log', None) is log:
+            del _state.request_log
+        stop_recording(log)
+        summary = log.format()
+        if request is not None:
+            logger.debug('%s %s: %s', request.method, request.path, summary,
+                extra=dict(request=request, queries=log))
+        return summary
+
+
+class QueryAssertionsMixin(object):
+    """Query budget assertions for test cases.
+
+    The views must be requested through a Django test client, with
+    QueryInstrumentationMiddleware installed.
+    """
+
+    @contextmanager
+    def assertIrisQueries(self, view, max):
+        """Fail unless `view` runs at most `max` queries inside the block.
+
+        `view` is a view function or its tag, e.g. ``'iris.views.topic'``.
+
+        Example::
+
+            with self.assertIrisQueries(views.topic, max=10):
+                self.client.get(topic.get_absolute_url())
+        """
+        tag = view if isinstance(view, basestring) else view_tag(view)
+        with record_queries() as log:
+            yield log
+        if tag not in log.tags:
+            self.fail('{0} was not called, or QueryInstrumentationMiddleware is not installed.'.format(tag))
+        count = log.count(tag)
+        if count > max:
+            self.fail('{0} ran {1} queries, more than {2}:\n{3}'.format(
+                tag, count, max,
+                '\n'.join(query.sql for query in log.queries if tag in query.tags),
+            ))
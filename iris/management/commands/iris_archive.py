@@ -0,0 +1,23 @@
+import datetime
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+from iris.conf import settings
+from iris.models import ArchivedItem
+
+
+class Command(NoArgsCommand):
+    help = 'Move old items out of the item table into the archive.'
+    option_list = NoArgsCommand.option_list + (
+        make_option('--days', type='int', dest='days', default=None,
+            help='Archive items older than this many days (default: IRIS_ARCHIVE_AFTER_DAYS).'),
+    )
+
+    def handle_noargs(self, **options):
+        days = options['days']
+        if days is None:
+            days = settings.ARCHIVE_AFTER_DAYS
+        before = datetime.datetime.now() - datetime.timedelta(days=days)
+        count = ArchivedItem.objects.archive(before)
+        self.stdout.write('Archived {0} items.\n'.format(count))
@@ -0,0 +1,27 @@
+import json
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+from iris import benchmarks
+
+
+class Command(NoArgsCommand):
+    help = 'Time the iris views against data from iris_benchmark_seed and report as JSON.'
+    option_list = NoArgsCommand.option_list + (
+        make_option('--repeat', type='int', dest='repeat', default=10,
+            help='The number of timed runs of each scenario.'),
+        make_option('--startup-repeat', type='int', dest='startup_repeat', default=5,
+            help='The number of processes started to time startup, or 0 to skip it.'),
+        make_option('--output', dest='output', default=None,
+            help='Write the report to this file instead of standard output.'),
+    )
+
+    def handle_noargs(self, **options):
+        report = benchmarks.run(repeat=options['repeat'], startup_repeat=options['startup_repeat'])
+        report = json.dumps(report, indent=2, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                output.write(report + '\n')
+        else:
+            self.stdout.write(report + '\n')
@@ -0,0 +1,28 @@
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+from iris import benchmarks
+
+
+class Command(NoArgsCommand):
+    help = 'Fill the database with synthetic topics, participants and items for benchmarks.'
+    option_list = NoArgsCommand.option_list + (
+        make_option('--topics', type='int', dest='topics', default=10,
+            help='The number of topics to create.'),
+        make_option('--items', type='int', dest='items', default=100,
+            help='The number of items per topic.'),
+        make_option('--participants', type='int', dest='participants', default=5,
+            help='The number of participants per topic.'),
+        make_option('--seed', type='int', dest='seed', default=0,
+            help='The random seed, for reproducible data.'),
+    )
+
+    def handle_noargs(self, **options):
+        topics = benchmarks.seed(
+            topics=options['topics'],
+            items=options['items'],
+            participants=options['participants'],
+            random_seed=options['seed'],
+        )
+        self.stdout.write('Created {0} topics.\n'.format(len(topics)))
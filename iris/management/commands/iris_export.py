@@ -0,0 +1,18 @@
+import sys
+
+from django.core.management.base import BaseCommand
+
+from iris.transfer import export_ndjson
+
+
+class Command(BaseCommand):
+    args = '[path]'
+    help = 'Export topics, items and participants as NDJSON to a file, or to standard output.'
+
+    def handle(self, path=None, **options):
+        if path is None:
+            export_ndjson(sys.stdout)
+            return
+        with open(path, 'wb') as stream:
+            count = export_ndjson(stream)
+        self.stdout.write('Exported {0} records.\n'.format(count))
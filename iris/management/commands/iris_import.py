@@ -0,0 +1,36 @@
+import os
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from iris.transfer import Importer
+
+
+class Command(BaseCommand):
+    args = 'path'
+    help = 'Import NDJSON written by iris_export, resuming from a checkpoint if there is one.'
+    option_list = BaseCommand.option_list + (
+        make_option('--checkpoint', dest='checkpoint', default=None,
+            help='The file that records progress (default: the path plus ".checkpoint").'),
+    )
+
+    def handle(self, path=None, **options):
+        if path is None:
+            raise CommandError('Give the path of the file to import.')
+        checkpoint_path = options['checkpoint'] or path + '.checkpoint'
+        skip = 0
+        if os.path.exists(checkpoint_path):
+            with open(checkpoint_path) as checkpoint_file:
+                skip = int(checkpoint_file.read().strip() or 0)
+            self.stdout.write('Resuming after line {0}.\n'.format(skip))
+
+        def checkpoint(line):
+            with open(checkpoint_path, 'w') as checkpoint_file:
+                checkpoint_file.write(str(line))
+
+        with open(path, 'rb') as lines:
+            count = Importer(checkpoint=checkpoint).run(lines, skip=skip)
+        # No checkpoint is written when there was nothing left to import.
+        if os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+        self.stdout.write('Imported {0} records.  Run iris_reindex to update the search index.\n'.format(count))
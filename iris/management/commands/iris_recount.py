@@ -0,0 +1,24 @@
+from django.core.management.base import NoArgsCommand
+
+from iris.caching import invalidate_topics
+from iris.conf import settings
+from iris.models import Topic
+
+
+class Command(NoArgsCommand):
+    help = 'Rebuild the last item, item count and active participant count of every topic.'
+
+    def handle_noargs(self, **options):
+        batch_size = settings.BULK_BATCH_SIZE
+        topic_count = 0
+        last_id = 0
+        while True:
+            topic_ids = list(Topic.objects.filter(id__gt=last_id).order_by('id')
+                             .values_list('id', flat=True)[:batch_size])
+            if not topic_ids:
+                break
+            Topic.objects.recount(topic_ids)
+            topic_count += len(topic_ids)
+            last_id = topic_ids[-1]
+        invalidate_topics()
+        self.stdout.write('Recounted {0} topics.\n'.format(topic_count))
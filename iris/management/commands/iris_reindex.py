@@ -0,0 +1,39 @@
+from django.core.management.base import NoArgsCommand
+
+from iris import search
+from iris.conf import settings
+from iris.models import Item, Topic
+
+
+class Command(NoArgsCommand):
+    help = 'Rebuild the full-text search index of topic subjects and item content.'
+
+    def handle_noargs(self, **options):
+        backend = search.get_backend()
+        backend.clear()
+        batch_size = settings.BULK_BATCH_SIZE
+        topic_count = item_count = 0
+        last_id = 0
+        while True:
+            topics = list(Topic.objects.filter(id__gt=last_id).order_by('id')
+                          .values_list('id', 'subject')[:batch_size])
+            if not topics:
+                break
+            backend.index([(topic_id, None, subject) for topic_id, subject in topics])
+            topic_count += len(topics)
+            last_id = topics[-1][0]
+        last_id = 0
+        while True:
+            items = list(Item.objects.all().with_generic('content').filter(id__gt=last_id)
+                         .order_by('id')[:batch_size])
+            if not items:
+                break
+            entries = []
+            for item in items:
+                text = search.item_search_text(item)
+                if text:
+                    entries.append((item.topic_id, item.id, text))
+            backend.index(entries)
+            item_count += len(entries)
+            last_id = items[-1].id
+        self.stdout.write('Indexed {0} topics and {1} items.\n'.format(topic_count, item_count))
@@ -0,0 +1,99 @@
+# encoding: utf-8
+import datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        
+        # Adding model 'InboxEntry'
+        db.create_table('iris_inboxentry', (
+            ('id', self.gf('django.db.models.fields.AutoField')(primary_key=True)),
+            ('content_type', self.gf('django.db.models.fields.related.ForeignKey')(related_name='+', to=orm['contenttypes.ContentType'])),
+            ('object_id', self.gf('django.db.models.fields.PositiveIntegerField')()),
+            ('topic', self.gf('django.db.models.fields.related.ForeignKey')(related_name='inbox_entries', to=orm['iris.Topic'])),
+            ('last_modified', self.gf('django.db.models.fields.DateTimeField')()),
+            ('unread_count', self.gf('django.db.models.fields.PositiveIntegerField')(default=0)),
+        ))
+        db.send_create_signal('iris', ['InboxEntry'])
+
+        # Adding unique constraint on 'InboxEntry', fields ['content_type', 'object_id', 'topic']
+        db.create_unique('iris_inboxentry', ['content_type_id', 'object_id', 'topic_id'])
+
+        # Adding index on 'InboxEntry', fields ['content_type', 'object_id', 'last_modified']
+        db.create_index('iris_inboxentry', ['content_type_id', 'object_id', 'last_modified'])
+
+
+    def backwards(self, orm):
+        
+        # Removing index on 'InboxEntry', fields ['content_type', 'object_id', 'last_modified']
+        db.delete_index('iris_inboxentry', ['content_type_id', 'object_id', 'last_modified'])
+
+        # Removing unique constraint on 'InboxEntry', fields ['content_type', 'object_id', 'topic']
+        db.delete_unique('iris_inboxentry', ['content_type_id', 'object_id', 'topic_id'])
+
+        # Deleting model 'InboxEntry'
+        db.delete_table('iris_inboxentry')
+
+
+    models = {
+        'contenttypes.contenttype': {
+            'Meta': {'ordering': "('name',)", 'unique_together': "(('app_label', 'model'),)", 'object_name': 'ContentType', 'db_table': "'django_content_type'"},
+            'app_label': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'model': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '100'})
+        },
+        'iris.inboxentry': {
+            'Meta': {'unique_together': "(('content_type', 'object_id', 'topic'),)", 'object_name': 'InboxEntry'},
+            'content_type': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'+'", 'to': "orm['contenttypes.ContentType']"}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'last_modified': ('django.db.models.fields.DateTimeField', [], {}),
+            'object_id': ('django.db.models.fields.PositiveIntegerField', [], {}),
+            'topic': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'inbox_entries'", 'to': "orm['iris.Topic']"}),
+            'unread_count': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'})
+        },
+        'iris.item': {
+            'Meta': {'ordering': "('created', 'id')", 'object_name': 'Item'},
+            'content_type': ('django.db.models.fields.related.ForeignKey', [], {'blank': 'True', 'related_name': "'+'", 'null': 'True', 'to': "orm['contenttypes.ContentType']"}),
+            'created': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now', 'db_index': 'True'}),
+            'creator_content_type': ('django.db.models.fields.related.ForeignKey', [], {'blank': 'True', 'related_name': "'+'", 'null': 'True', 'to': "orm['contenttypes.ContentType']"}),
+            'creator_object_id': ('django.db.models.fields.PositiveIntegerField', [], {'null': 'True', 'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'object_id': ('django.db.models.fields.PositiveIntegerField', [], {'null': 'True', 'blank': 'True'}),
+            'topic': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'items'", 'to': "orm['iris.Topic']"})
+        },
+        'iris.participant': {
+            'Meta': {'unique_together': "(('topic', 'content_type', 'object_id'),)", 'object_name': 'Participant'},
+            'content_type': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['contenttypes.ContentType']", 'null': 'True', 'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'is_active': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            'item_last_read': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['iris.Item']", 'null': 'True', 'blank': 'True'}),
+            'object_id': ('django.db.models.fields.PositiveIntegerField', [], {'null': 'True', 'blank': 'True'}),
+            'topic': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'participants'", 'to': "orm['iris.Topic']"}),
+            'unread_count': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'})
+        },
+        'iris.participantjoin': {
+            'Meta': {'object_name': 'ParticipantJoin'},
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'participant': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'+'", 'to': "orm['iris.Participant']"})
+        },
+        'iris.participantleave': {
+            'Meta': {'object_name': 'ParticipantLeave'},
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'participant': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'+'", 'to': "orm['iris.Participant']"})
+        },
+        'iris.topic': {
+            'Meta': {'ordering': "('modified',)", 'object_name': 'Topic'},
+            'created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'creator_content_type': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['contenttypes.ContentType']", 'null': 'True', 'blank': 'True'}),
+            'creator_object_id': ('django.db.models.fields.PositiveIntegerField', [], {'null': 'True', 'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'modified': ('django.db.models.fields.DateTimeField', [], {'db_index': 'True', 'null': 'True', 'blank': 'True'}),
+            'subject': ('django.db.models.fields.CharField', [], {'max_length': '255'})
+        }
+    }
+
+    complete_apps = ['iris']
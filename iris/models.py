@@ -1,24 +1,371 @@
 import datetime
+from operator import or_
 
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.contenttypes import generic
+from django.core.cache import cache
 from django.core.urlresolvers import reverse
-from django.db import models
+from django.db import connection, models, transaction
+from django.db.models import F, Max, Q
+from django.db.models.query import QuerySet
 from django.template.defaultfilters import slugify
 from django.utils.translation import ugettext_lazy as _
 
+from iris import events, search
+from iris.caching import invalidate_roster, invalidate_rosters, invalidate_topics, roster_cache_key
+from iris.coalesce import modified_buffer
 from iris.conf import settings
+from iris.pagination import decode_cursor, encode_cursor, keyset_page, merge_pages
+
+
+def prefetch_generic(instances, name):
+    """Fill the cache of the GenericForeignKey `name` on each of `instances`.
+
+    Object ids are grouped by content type so that each type costs a single
+    `in_bulk` query.  The content type foreign keys are filled from the
+    ContentType cache as well.
+    """
+    if not instances:
+        return
+    gfk = getattr(instances[0].__class__, name)
+    ct_field = instances[0]._meta.get_field(gfk.ct_field)
+    ids_by_ct = {}
+    for instance in instances:
+        ct_id = getattr(instance, ct_field.attname)
+        if ct_id is not None:
+            ids_by_ct.setdefault(ct_id, set()).add(getattr(instance, gfk.fk_field))
+    objects_by_ct = {}
+    for ct_id, ids in ids_by_ct.items():
+        model_class = ContentType.objects.get_for_id(ct_id).model_class()
+        if model_class is not None:
+            objects_by_ct[ct_id] = model_class._default_manager.in_bulk(list(ids))
+    for instance in instances:
+        ct_id = getattr(instance, ct_field.attname)
+        if ct_id is None:
+            setattr(instance, gfk.cache_attr, None)
+            continue
+        setattr(instance, ct_field.get_cache_name(), ContentType.objects.get_for_id(ct_id))
+        objects = objects_by_ct.get(ct_id)
+        if objects is not None:
+            setattr(instance, gfk.cache_attr, objects.get(getattr(instance, gfk.fk_field)))
+
+
+class GenericPrefetchQuerySet(QuerySet):
+    """A QuerySet that can fetch GenericForeignKey targets in bulk."""
+
+    _generic_names = ()
+
+    def with_generic(self, *names):
+        """Return a clone that fills the named GenericForeignKeys in bulk."""
+        return self._clone(_generic_names=self._generic_names + names)
+
+    def _clone(self, *args, **kwargs):
+        kwargs.setdefault('_generic_names', self._generic_names)
+        return super(GenericPrefetchQuerySet, self)._clone(*args, **kwargs)
+
+    def iterator(self):
+        iterator = super(GenericPrefetchQuerySet, self).iterator()
+        if not self._generic_names:
+            return iterator
+        instances = list(iterator)
+        self._prefetch(instances)
+        return iter(instances)
+
+    def _prefetch(self, instances):
+        for name in self._generic_names:
+            prefetch_generic(instances, name)
+
+
+class ItemQuerySet(GenericPrefetchQuerySet):
+
+    def with_related(self):
+        """Return a clone that fetches the content and creator of items in bulk."""
+        return self.with_generic('content', 'creator')
+
+    def _prefetch(self, instances):
+        super(ItemQuerySet, self)._prefetch(instances)
+        if 'content' in self._generic_names:
+            _prefetch_changes(instances)
+
+
+def prefetch_items(items):
+    """Fetch the content and creators of a list of items in bulk."""
+    prefetch_generic(items, 'content')
+    prefetch_generic(items, 'creator')
+    _prefetch_changes(items)
+
+
+def _prefetch_changes(items):
+    # Join and leave items render their participant's content too.
+    changes = [
+        item.content for item in items
+        if isinstance(item.content, (ParticipantJoin, ParticipantLeave))
+    ]
+    participants = Participant.objects.in_bulk(
+        list(set(change.participant_id for change in changes)))
+    prefetch_generic(participants.values(), 'content')
+    for change in changes:
+        change._participant_cache = participants.get(change.participant_id)
+
+
+def _create_changes(model, participant_ids):
+    # Creates a ParticipantJoin or ParticipantLeave for each participant,
+    # returning their ids by participant.  bulk_create does not return
+    # primary keys, so they are found as the newest of each participant.
+    model.objects.bulk_create([model(participant_id=participant_id) for participant_id in participant_ids])
+    return dict(
+        model.objects.filter(participant__in=participant_ids)
+        .values('participant').annotate(latest=Max('id')).values_list('participant', 'latest')
+    )
+
+
+class ItemManager(models.Manager):
+
+    def get_query_set(self):
+        return ItemQuerySet(self.model, using=self._db)
+
+    def with_related(self):
+        return self.get_query_set().with_related()
+
+
+class ParticipantQuerySet(GenericPrefetchQuerySet):
+
+    def with_content(self):
+        """Return a clone that fetches the content of participants in bulk."""
+        return self.with_generic('content')
+
+
+class ParticipantManager(models.Manager):
+
+    def get_query_set(self):
+        return ParticipantQuerySet(self.model, using=self._db)
+
+    def with_content(self):
+        return self.get_query_set().with_content()
 
 
 class TopicManager(models.Manager):
 
+    def touch(self, topic_id, modified, **counts):
+        """Advance a topic's modified timestamp to `modified` in one UPDATE.
+
+        The timestamp never moves backwards, so racing inserts are harmless.
+        """
+        return self.touch_many([topic_id], modified, **counts)
+
+    def touch_many(self, topic_ids, modified, **counts):
+        """Advance the modified timestamps of many topics at once.
+
+        Keyword arguments are passed to `add_counts`, which then advances
+        the timestamps in the same UPDATE as the counts.
+        """
+        InboxEntry.objects.filter(topic__in=topic_ids, last_modified__lt=modified).update(
+            last_modified=modified)
+        if counts:
+            return self.add_counts(topic_ids, modified=modified, **counts)
+        return self.filter(pk__in=topic_ids).filter(
+            Q(modified__lt=modified) | Q(modified__isnull=True)
+        ).update(modified=modified)
+
+    def add_unread(self, topic_ids, creator, count=1):
+        """Count `count` new items in each topic as unread for every active participant but `creator`."""
+        participants = Participant.objects.filter(topic__in=topic_ids, is_active=True)
+        entries = InboxEntry.objects.filter(topic__in=topic_ids)
+        if isinstance(creator, models.Model):
+            content_type = ContentType.objects.get_for_model(creator)
+            participants = participants.exclude(content_type=content_type, object_id=creator.id)
+            entries = entries.exclude(content_type=content_type, object_id=creator.id)
+        entries.update(unread_count=F('unread_count') + count)
+        return participants.update(unread_count=F('unread_count') + count)
+
+    def add_counts(self, topic_ids, items=0, participants=0, since_item_id=None, modified=None):
+        """Add to the item and active participant counts of topics in one UPDATE.
+
+        Unless `since_item_id` is None, each topic's `last_item` also moves
+        to its newest item with an id of at least `since_item_id`; pass the
+        lowest id of the items just added.  Unless `modified` is None, it
+        also advances the topics' modified timestamps as `touch_many` does.
+        Call this in the transaction that added the items or participants.
+        """
+        if not topic_ids:
+            return 0
+        qn = connection.ops.quote_name
+        topic_table = qn(self.model._meta.db_table)
+        assignments = [
+            '{0} = {0} + %s'.format(qn('item_count')),
+            '{0} = {0} + %s'.format(qn('active_participant_count')),
+        ]
+        params = [items, participants]
+        if modified is not None:
+            assignments.append(
+                '{0} = CASE WHEN {0} IS NULL OR {0} < %s THEN %s ELSE {0} END'.format(qn('modified')))
+            modified = connection.ops.value_to_db_datetime(modified)
+            params.extend([modified, modified])
+        if since_item_id is not None:
+            assignments.append(
+                '{last_item_id} = COALESCE((SELECT MAX({id}) FROM {item} '
+                'WHERE {item}.{topic_id} = {topic}.{id} AND {item}.{id} >= %s), {last_item_id})'.format(
+                    topic=topic_table,
+                    item=qn(Item._meta.db_table),
+                    last_item_id=qn('last_item_id'),
+                    topic_id=qn('topic_id'),
+                    id=qn('id'),
+                )
+            )
+            params.append(since_item_id)
+        params.extend(topic_ids)
+        cursor = connection.cursor()
+        cursor.execute('UPDATE {0} SET {1} WHERE {2} IN ({3})'.format(
+            topic_table,
+            ', '.join(assignments),
+            qn('id'),
+            ', '.join(['%s'] * len(topic_ids)),
+        ), params)
+        transaction.set_dirty()
+        return cursor.rowcount
+
+    def recount(self, topic_ids=None):
+        """Rebuild `last_item`, `item_count` and `active_participant_count` from scratch.
+
+        Counts include archived items.  `topic_ids` limits the topics
+        recounted; by default every topic is.
+        """
+        qn = connection.ops.quote_name
+        sql = (
+            'UPDATE {topic} SET '
+            '{item_count} = (SELECT COUNT(*) FROM {item} WHERE {item}.{topic_id} = {topic}.{id}) '
+            '+ (SELECT COUNT(*) FROM {archived} WHERE {archived}.{topic_id} = {topic}.{id}), '
+            '{active_participant_count} = (SELECT COUNT(*) FROM {participant} '
+            'WHERE {participant}.{topic_id} = {topic}.{id} AND {participant}.{is_active} = %s), '
+            '{last_item_id} = (SELECT MAX({id}) FROM {item} WHERE {item}.{topic_id} = {topic}.{id})'
+        ).format(
+            topic=qn(self.model._meta.db_table),
+            item=qn(Item._meta.db_table),
+            archived=qn(ArchivedItem._meta.db_table),
+            participant=qn(Participant._meta.db_table),
+            item_count=qn('item_count'),
+            active_participant_count=qn('active_participant_count'),
+            last_item_id=qn('last_item_id'),
+            topic_id=qn('topic_id'),
+            is_active=qn('is_active'),
+            id=qn('id'),
+        )
+        params = [True]
+        if topic_ids is not None:
+            if not topic_ids:
+                return
+            sql += ' WHERE {0} IN ({1})'.format(qn('id'), ', '.join(['%s'] * len(topic_ids)))
+            params.extend(topic_ids)
+        # The rebuilt counts already include any buffered by IRIS_COALESCE_TOPIC_MODIFIED.
+        modified_buffer.discard_counts(topic_ids)
+        with transaction.commit_on_success():
+            cursor = connection.cursor()
+            cursor.execute(sql, params)
+            transaction.set_dirty()
+
+    def remove_participant(self, creator, obj, topics=None, older_than=None):
+        """Remove the object from many topics at once, returning the ParticipantLeave items created.
+
+        `topics` is a list or queryset of topics, or None for every topic
+        the object actively participates in.  Set `older_than` to a datetime
+        to only leave topics last modified before it, e.g. to archive an
+        inbox.  Topics are handled in batches of ``IRIS_BULK_BATCH_SIZE``
+        with a fixed number of queries each.
+        """
+        content_type = ContentType.objects.get_for_model(obj)
+        participants = Participant.objects.filter(
+            content_type=content_type,
+            object_id=obj.id,
+            is_active=True,
+        )
+        if topics is not None:
+            if isinstance(topics, QuerySet):
+                participants = participants.filter(topic__in=topics.values('pk'))
+            else:
+                participants = participants.filter(topic__in=[topic.pk for topic in topics])
+        if older_than is not None:
+            participants = participants.filter(topic__modified__lt=older_than)
+        leaving = list(participants.values_list('id', 'topic'))
+        leave_ct = ContentType.objects.get_for_model(ParticipantLeave)
+        batch_size = settings.BULK_BATCH_SIZE
+        items = []
+        for start in range(0, len(leaving), batch_size):
+            batch = leaving[start:start + batch_size]
+            participant_ids = [participant_id for participant_id, topic_id in batch]
+            topic_ids = [topic_id for participant_id, topic_id in batch]
+            now = datetime.datetime.now()
+            with transaction.commit_on_success():
+                Participant.objects.filter(pk__in=participant_ids).update(is_active=False)
+                InboxEntry.objects.filter(
+                    content_type=content_type,
+                    object_id=obj.id,
+                    topic__in=topic_ids,
+                ).delete()
+                leave_ids = _create_changes(ParticipantLeave, participant_ids)
+                Item.objects.bulk_create([
+                    Item(
+                        topic_id=topic_id,
+                        created=now,
+                        creator=creator,
+                        content_type=leave_ct,
+                        object_id=leave_ids[participant_id],
+                    )
+                    for participant_id, topic_id in batch
+                ])
+                batch_items = list(Item.objects.filter(
+                    topic__in=topic_ids,
+                    content_type=leave_ct,
+                    object_id__in=leave_ids.values(),
+                ).order_by('id'))
+                self.add_unread(topic_ids, creator)
+                counts = dict(items=1, participants=-1, since_item_id=batch_items[0].id)
+                if not settings.COALESCE_TOPIC_MODIFIED:
+                    self.touch_many(topic_ids, now, **counts)
+            if settings.COALESCE_TOPIC_MODIFIED:
+                for topic_id in topic_ids:
+                    modified_buffer.record(topic_id, now, **counts)
+            invalidate_rosters(topic_ids)
+            items.extend(batch_items)
+        if leaving:
+            invalidate_topics()
+        for item in items:
+            events.send_item_added(item)
+        return items
+
+    def inbox(self, obj):
+        """Return topics the object actively participates in, most recently modified first.
+
+        Reads the participant's inbox entries, so the N most recent topics
+        are a single index range scan.  Each topic carries the participant's
+        `unread_count`.
+        """
+        content_type = ContentType.objects.get_for_model(obj)
+        return self.filter(
+            inbox_entries__content_type=content_type,
+            inbox_entries__object_id=obj.id,
+        ).extra(select=dict(
+            unread_count='{0}.{1}'.format(
+                connection.ops.quote_name(InboxEntry._meta.db_table),
+                connection.ops.quote_name('unread_count'),
+            ),
+        )).order_by('-inbox_entries__last_modified', '-id')
+
     def with_participant(self, obj):
+        """Return topics the object actively participates in.
+
+        Each topic carries the participant's `unread_count`.
+        """
         content_type = ContentType.objects.get_for_model(obj)
         return self.filter(
             participants__content_type__pk=content_type.id,
             participants__object_id=obj.id,
             participants__is_active=True,
-        )
+        ).extra(select=dict(
+            unread_count='{0}.{1}'.format(
+                connection.ops.quote_name(Participant._meta.db_table),
+                connection.ops.quote_name('unread_count'),
+            ),
+        ))
 
 
 class Topic(models.Model):
@@ -27,6 +374,16 @@ class Topic(models.Model):
     subject = models.CharField(max_length=255)
     created = models.DateTimeField(auto_now_add=True)
     modified = models.DateTimeField(blank=True, null=True, db_index=True)
+    # The creation time of the newest archived item, if any.
+    archived_until = models.DateTimeField(blank=True, null=True)
+    # A summary of the topic, kept up to date as items are added and
+    # participants join and leave, and recounted when an item is deleted
+    # with Item.delete().  Queryset deletes leave it stale;
+    # ``manage.py iris_recount`` rebuilds it.  With
+    # IRIS_COALESCE_TOPIC_MODIFIED on, it lags like `modified` does.
+    last_item = models.ForeignKey('Item', blank=True, null=True, related_name='+', on_delete=models.SET_NULL)
+    item_count = models.PositiveIntegerField(default=0)
+    active_participant_count = models.PositiveIntegerField(default=0)
 
     creator_content_type = models.ForeignKey(ContentType, blank=True, null=True)
     creator_object_id = models.PositiveIntegerField(blank=True, null=True)
@@ -47,7 +404,13 @@ class Topic(models.Model):
 
     def save(self, *args, **kwargs):
         self.subject = self.subject.strip()
-        return super(Topic, self).save(*args, **kwargs)
+        if self.modified is None:
+            # Keeps new topics in (modified, id) keyset order.
+            self.modified = datetime.datetime.now()
+        result = super(Topic, self).save(*args, **kwargs)
+        invalidate_topics()
+        search.index_topic(self)
+        return result
 
     def get_absolute_url(self):
         return reverse('iris_topic_slug', kwargs=dict(
@@ -55,6 +418,21 @@ class Topic(models.Model):
             slug=slugify(self.subject),
         ))
 
+    def get_etag(self):
+        """Return an ETag that changes whenever an item is added to the topic.
+
+        When ``IRIS_COALESCE_TOPIC_MODIFIED`` is on, the topic row may not
+        show the newest item yet, so its id is read from the items instead.
+        """
+        last_item_id = self.last_item_id
+        if settings.COALESCE_TOPIC_MODIFIED:
+            last_item_id = self.items.aggregate(latest=Max('id'))['latest']
+        return '{0}-{1}-{2}'.format(
+            self.id,
+            self.modified.strftime('%Y%m%d%H%M%S%f') if self.modified else '',
+            last_item_id or 0,
+        )
+
     def add_item(self, creator, obj):
         """Add the object as an item, returning a saved item."""
         item = Item(
@@ -62,25 +440,264 @@ class Topic(models.Model):
             creator=creator,
             content=obj,
         )
-        item.save()
+        with transaction.commit_on_success():
+            adding = item._save_counted()
+            self.add_unread(creator)
+        item._saved(adding)
+        events.send_item_added(item)
+        search.index_item(item)
         return item
 
     def add_participant(self, creator, obj):
-        """Add the object as a participant, returning the ParticipantJoin item created."""
-        participant = Participant(
-            topic=self,
-            content=obj,
+        """Add the object as a participant, returning the ParticipantJoin item created.
+
+        A former participant is reactivated.  Returns None if the object
+        already actively participates.
+        """
+        items = self.add_participants(creator, [obj])
+        return items[0] if items else None
+
+    def remove_participant(self, creator, obj):
+        """Remove the object as a participant, returning the ParticipantLeave item created.
+
+        Returns None if the object does not actively participate.
+        """
+        items = Topic.objects.remove_participant(creator, obj, topics=[self])
+        self._roster = None
+        if not items:
+            return None
+        item = items[0]
+        if self.modified is None or self.modified < item.created:
+            self.modified = item.created
+        self.item_count += 1
+        self.active_participant_count -= 1
+        self.last_item = item
+        return item
+
+    def item_page(self, older=None, newer=None, per_page=None, related=True):
+        """Return a KeysetPage of this topic's items, newest first.
+
+        `older` and `newer` are cursors taken from a previous page.  Set
+        `related` to False to leave fetching the items' content and
+        creators to the caller, e.g. the ``itemfragments`` template tag.
+        Pages that reach back past `archived_until` include archived items.
+        """
+        per_page = per_page or settings.ITEMS_PER_PAGE
+        items = self.items.all()
+        page = keyset_page(items.with_related() if related else items,
+                           field='created', per_page=per_page, older=older, newer=newer)
+        if self.archived_until is None:
+            return page
+        if newer is not None:
+            reaches_archive = decode_cursor(newer)[0] <= self.archived_until
+        else:
+            reaches_archive = not page.has_older or page.object_list[-1].created <= self.archived_until
+        if not reaches_archive:
+            return page
+        archived = self.archived_items.all()
+        archived_page = keyset_page(archived.with_related() if related else archived,
+                                    field='created', per_page=per_page, older=older, newer=newer)
+        return merge_pages([page, archived_page], per_page, newer=newer is not None)
+
+    def add_participants(self, creator, objs):
+        """Add each of the objects as a participant, returning the ParticipantJoin items created.
+
+        Objects that already actively participate are skipped, and inactive
+        participants are reactivated.  The number of queries does not depend
+        on the number of objects.
+        """
+        keys = []
+        for obj in objs:
+            key = (ContentType.objects.get_for_model(obj).id, obj.id)
+            if key not in keys:
+                keys.append(key)
+        if not keys:
+            return []
+        ids_by_ct = {}
+        for ct_id, object_id in keys:
+            ids_by_ct.setdefault(ct_id, []).append(object_id)
+        query = reduce(or_, [
+            Q(content_type=ct_id, object_id__in=object_ids)
+            for ct_id, object_ids in ids_by_ct.items()
+        ])
+        existing = dict(
+            ((p.content_type_id, p.object_id), p)
+            for p in self.participants.filter(query)
         )
-        participant.save()
-        joined = ParticipantJoin(
-            participant=participant,
+        joining = [key for key in keys if key not in existing or not existing[key].is_active]
+        if not joining:
+            return []
+        now = datetime.datetime.now()
+        join_ct = ContentType.objects.get_for_model(ParticipantJoin)
+        with transaction.commit_on_success():
+            # Count the join items as unread before anyone new is active.
+            self.add_unread(creator, len(joining))
+            Participant.objects.bulk_create([
+                Participant(topic=self, content_type_id=ct_id, object_id=object_id)
+                for ct_id, object_id in joining
+                if (ct_id, object_id) not in existing
+            ])
+            inactive = [p for p in existing.values() if not p.is_active]
+            if inactive:
+                # Returning participants start afresh, as their new inbox entries do.
+                Participant.objects.filter(pk__in=[p.id for p in inactive]).update(
+                    is_active=True, unread_count=0)
+                # Clear out any inbox entries left behind by the departed.
+                InboxEntry.objects.filter(topic=self).filter(reduce(or_, [
+                    Q(content_type=p.content_type_id, object_id=p.object_id)
+                    for p in inactive
+                ])).delete()
+            InboxEntry.objects.bulk_create([
+                InboxEntry(topic=self, content_type_id=ct_id, object_id=object_id, last_modified=now)
+                for ct_id, object_id in joining
+            ])
+            participants = dict(
+                ((p.content_type_id, p.object_id), p)
+                for p in self.participants.filter(query)
+            )
+            participant_ids = [participants[key].id for key in joining]
+            join_ids = _create_changes(ParticipantJoin, participant_ids)
+            Item.objects.bulk_create([
+                Item(
+                    topic=self,
+                    created=now,
+                    creator=creator,
+                    content_type=join_ct,
+                    object_id=join_ids[participant_id],
+                )
+                for participant_id in participant_ids
+            ])
+            items = list(Item.objects.filter(
+                topic=self,
+                content_type=join_ct,
+                object_id__in=join_ids.values(),
+            ).order_by('id'))
+            counts = dict(items=len(items), participants=len(joining), since_item_id=items[0].id)
+            if not settings.COALESCE_TOPIC_MODIFIED:
+                self.touch(now, **counts)
+        if settings.COALESCE_TOPIC_MODIFIED:
+            self.touch(now, **counts)
+        invalidate_topics()
+        self.invalidate_roster()
+        self.item_count += len(items)
+        self.active_participant_count += len(joining)
+        self.last_item = items[-1]
+        for item in items:
+            item._topic_cache = self
+            events.send_item_added(item)
+        return items
+
+    def add_unread(self, creator, count=1):
+        """Count `count` new items as unread for every active participant but `creator`."""
+        return Topic.objects.add_unread([self.id], creator, count)
+
+    def mark_read(self, obj, item=None):
+        """Mark the topic as read by the object up to `item`, or the latest item.
+
+        The read marker only ever advances.  Returns True if it moved.
+        """
+        if item is None:
+            latest = list(self.items.order_by('-id')[:1])
+            if not latest:
+                return False
+            item = latest[0]
+        content_type = ContentType.objects.get_for_model(obj)
+        qn = connection.ops.quote_name
+        # The unread count is taken in the same statement that moves the
+        # marker, so that items added meanwhile are neither lost nor
+        # counted twice.  As in add_unread, the object's own items are
+        # never unread.
+        unread_count = (
+            '(SELECT COUNT(*) FROM {item} WHERE {item}.{topic_id} = %s AND {item}.{id} > %s '
+            'AND NOT (COALESCE({item}.{creator_content_type_id}, 0) = %s '
+            'AND COALESCE({item}.{creator_object_id}, 0) = %s))'.format(
+                item=qn(Item._meta.db_table),
+                topic_id=qn('topic_id'),
+                id=qn('id'),
+                creator_content_type_id=qn('creator_content_type_id'),
+                creator_object_id=qn('creator_object_id'),
+            )
         )
-        joined.save()
-        return self.add_item(creator, joined)
+        count_params = [self.id, item.id, content_type.id, obj.id]
+        with transaction.commit_on_success():
+            cursor = connection.cursor()
+            cursor.execute(
+                'UPDATE {participant} SET {item_last_read_id} = %s, {unread_count} = {count} '
+                'WHERE {topic_id} = %s AND {content_type_id} = %s AND {object_id} = %s '
+                'AND ({item_last_read_id} IS NULL OR {item_last_read_id} < %s)'.format(
+                    participant=qn(Participant._meta.db_table),
+                    item_last_read_id=qn('item_last_read_id'),
+                    unread_count=qn('unread_count'),
+                    count=unread_count,
+                    topic_id=qn('topic_id'),
+                    content_type_id=qn('content_type_id'),
+                    object_id=qn('object_id'),
+                ),
+                [item.id] + count_params + [self.id, content_type.id, obj.id, item.id],
+            )
+            advanced = cursor.rowcount
+            if advanced:
+                cursor.execute(
+                    'UPDATE {entry} SET {unread_count} = {count} '
+                    'WHERE {topic_id} = %s AND {content_type_id} = %s AND {object_id} = %s'.format(
+                        entry=qn(InboxEntry._meta.db_table),
+                        unread_count=qn('unread_count'),
+                        count=unread_count,
+                        topic_id=qn('topic_id'),
+                        content_type_id=qn('content_type_id'),
+                        object_id=qn('object_id'),
+                    ),
+                    count_params + [self.id, content_type.id, obj.id],
+                )
+            transaction.set_dirty()
+        return bool(advanced)
+
+    def touch(self, modified, **counts):
+        """Advance this topic's modified timestamp to `modified`, never backwards.
+
+        Keyword arguments are passed to `TopicManager.add_counts`.  When
+        ``IRIS_COALESCE_TOPIC_MODIFIED`` is on, they are buffered along with
+        the timestamp, so call this once the items have been committed.
+        """
+        if settings.COALESCE_TOPIC_MODIFIED:
+            modified_buffer.record(self.id, modified, **counts)
+        else:
+            Topic.objects.touch(self.id, modified, **counts)
+        if self.modified is None or self.modified < modified:
+            self.modified = modified
+
+    @property
+    def roster(self):
+        """Map the ``(content_type_id, object_id)`` of each participant to whether it is active.
+
+        The roster is kept in the Django cache under a key that changes
+        whenever participants join or leave, and once read, on this
+        instance for the rest of the request.
+        """
+        roster = getattr(self, '_roster', None)
+        if roster is None:
+            key = roster_cache_key(self.id)
+            roster = cache.get(key)
+            if roster is None:
+                roster = dict(
+                    ((content_type_id, object_id), is_active)
+                    for content_type_id, object_id, is_active
+                    in self.participants.values_list('content_type', 'object_id', 'is_active')
+                )
+                cache.set(key, roster, settings.ROSTER_CACHE_TIMEOUT)
+            self._roster = roster
+        return roster
+
+    def invalidate_roster(self):
+        """Forget the roster after participants join or leave."""
+        self._roster = None
+        invalidate_roster(self.id)
 
     def get_participant(self, obj):
         """Get participation information for the given object."""
         content_type = ContentType.objects.get_for_model(obj)
+        if (content_type.id, obj.id) not in self.roster:
+            return None
         try:
             return Participant.objects.get(
                 topic=self,
@@ -93,8 +710,8 @@ class Topic(models.Model):
     def has_participant(self, obj):
         if not isinstance(obj, models.Model):
             return False
-        participant = self.get_participant(obj)
-        return participant is not None and participant.is_active
+        content_type = ContentType.objects.get_for_model(obj)
+        return self.roster.get((content_type.id, obj.id), False)
 
     def item_last_read_by(self, obj):
         content_type = ContentType.objects.get_for_model(obj)
@@ -111,33 +728,39 @@ class Topic(models.Model):
             content_type = ContentType.objects.get(app_label=app_label, model=model)
         else:
             content_type = ContentType.objects.get_for_model(model_class)
-        return self.participants.filter(content_type=content_type, is_active=True)
+        return self.participants.filter(content_type=content_type, is_active=True).with_content()
 
 
-class Item(models.Model):
-    """An item in a conversation."""
+class BaseItem(models.Model):
+    """Fields and behavior shared by items and archived items."""
 
-    topic = models.ForeignKey('Topic', related_name='items', db_index=True)
     created = models.DateTimeField(default=datetime.datetime.now, db_index=True) # don't use auto_now_add since we sometimes want to override this on create
 
     content_type = models.ForeignKey(ContentType, blank=True, null=True, related_name='+')
     object_id = models.PositiveIntegerField(blank=True, null=True)
-    content = generic.GenericForeignKey("content_type", "object_id")
 
     creator_content_type = models.ForeignKey(ContentType, blank=True, null=True, related_name='+')
     creator_object_id = models.PositiveIntegerField(blank=True, null=True)
-    creator = generic.GenericForeignKey("creator_content_type", "creator_object_id")
 
     class Meta:
+        abstract = True
         get_latest_by = 'created'
-        ordering = ('created',)
+        # Timelines are paginated by (created, id); see migrations 0004 and
+        # 0009 for the matching (topic, created, id) indexes.
+        ordering = ('created', 'id')
 
     def __unicode__(self):
         return u"{0}: {1}".format(self.creator, self.content)
 
     def get_absolute_url(self):
-        """Return the topic's absolute url with a query string and hash for this item."""
-        return '{0}?i={1}#i{1}'.format(self.topic.get_absolute_url(), self.id)
+        """Return the url of the page of the topic that starts at this item, with a hash for it."""
+        # Pages hold the items before an `older` cursor, so the cursor is
+        # placed just after this item's (created, id) position.
+        return '{0}?older={1}#i{2}'.format(
+            self.topic.get_absolute_url(),
+            encode_cursor(self.created, self.id + 1),
+            self.id,
+        )
 
     def get_items_after_url(self):
         """Return an URL that will return all of the items in the topic after this item."""
@@ -146,11 +769,12 @@ class Item(models.Model):
             after_item_id=self.id,
         ))
 
-    def save(self, *args, **kwargs):
-        super(Item, self).save(*args, **kwargs)
-        topic = self.topic
-        topic.modified = self.created
-        topic.save()
+    def get_items_stream_url(self):
+        """Return an URL that streams the items in the topic after this item."""
+        return reverse('iris_items_stream', kwargs=dict(
+            topic_id=self.topic_id,
+            after_item_id=self.id,
+        ))
 
     def css_class(self):
         """Return a CSS class corresponding to this item's content type."""
@@ -163,6 +787,122 @@ class Item(models.Model):
         return 'iris/items/{0}.{1}.view.html'.format(ct.app_label, ct.model)
 
 
+class Item(BaseItem):
+    """An item in a conversation."""
+
+    topic = models.ForeignKey('Topic', related_name='items', db_index=True)
+    content = generic.GenericForeignKey("content_type", "object_id")
+    creator = generic.GenericForeignKey("creator_content_type", "creator_object_id")
+
+    objects = ItemManager()
+
+    def save(self, *args, **kwargs):
+        with transaction.commit_on_success():
+            adding = self._save_counted(*args, **kwargs)
+        self._saved(adding)
+
+    def delete(self, *args, **kwargs):
+        topic_id, item_id = self.topic_id, self.id
+        super(Item, self).delete(*args, **kwargs)
+        Topic.objects.recount([topic_id])
+        invalidate_topics()
+        search.remove_items([item_id])
+
+    def _save_counted(self, *args, **kwargs):
+        # Saves the item and counts it on its topic, returning whether it
+        # was added.  The caller manages the transaction, since nesting
+        # commit_on_success would commit the caller's transaction early.
+        adding = self.pk is None
+        super(Item, self).save(*args, **kwargs)
+        if not settings.COALESCE_TOPIC_MODIFIED:
+            counts = dict(items=1, since_item_id=self.id) if adding else {}
+            Topic.objects.touch(self.topic_id, self.created, **counts)
+        return adding
+
+    def _saved(self, adding):
+        # Runs once the transaction of _save_counted has been committed.
+        if settings.COALESCE_TOPIC_MODIFIED:
+            counts = dict(items=1, since_item_id=self.id) if adding else {}
+            modified_buffer.record(self.topic_id, self.created, **counts)
+        else:
+            invalidate_topics()
+        # Keep an already-loaded topic in step without fetching it.
+        topic = getattr(self, Item._meta.get_field('topic').get_cache_name(), None)
+        if topic is not None:
+            if topic.modified is None or topic.modified < self.created:
+                topic.modified = self.created
+            if adding:
+                topic.item_count += 1
+                topic.last_item = self
+
+
+class ArchivedItemManager(ItemManager):
+
+    def archive(self, before):
+        """Move items created before `before` out of the item table, returning how many moved.
+
+        Each topic's newest item and items marked as last read by a
+        participant stay put.  Items keep their ids, and each topic's
+        `archived_until` records its newest archived item, so that
+        `Topic.item_page` knows when to read through to the archive.
+        Archived items are removed from the search index.
+        """
+        items_table = connection.ops.quote_name(Item._meta.db_table)
+        archive_table = connection.ops.quote_name(self.model._meta.db_table)
+        columns = ', '.join(connection.ops.quote_name(field.column) for field in Item._meta.local_fields)
+        batch_size = settings.BULK_BATCH_SIZE
+        archived = 0
+        last_id = 0
+        while True:
+            batch = list(Item.objects.filter(created__lt=before, id__gt=last_id)
+                         .order_by('id').values_list('id', 'topic')[:batch_size])
+            if not batch:
+                break
+            last_id = batch[-1][0]
+            item_ids = [item_id for item_id, topic_id in batch]
+            topic_ids = list(set(topic_id for item_id, topic_id in batch))
+            keep = set(Participant.objects.filter(item_last_read__in=item_ids)
+                       .values_list('item_last_read', flat=True))
+            keep.update(latest for topic_id, latest in Item.objects.filter(topic__in=topic_ids)
+                        .order_by().values('topic').annotate(latest=Max('id')).values_list('topic', 'latest'))
+            item_ids = [item_id for item_id in item_ids if item_id not in keep]
+            if not item_ids:
+                continue
+            placeholders = ', '.join(['%s'] * len(item_ids))
+            with transaction.commit_on_success():
+                cursor = connection.cursor()
+                cursor.execute(
+                    'INSERT INTO {0} ({1}) SELECT {1} FROM {2} WHERE id IN ({3})'.format(
+                        archive_table, columns, items_table, placeholders),
+                    item_ids,
+                )
+                cursor.execute(
+                    'DELETE FROM {0} WHERE id IN ({1})'.format(items_table, placeholders),
+                    item_ids,
+                )
+                transaction.set_dirty()
+                newest = (self.filter(pk__in=item_ids).order_by().values('topic')
+                          .annotate(latest=Max('created')).values_list('topic', 'latest'))
+                for topic_id, created in newest:
+                    Topic.objects.filter(pk=topic_id).filter(
+                        Q(archived_until__lt=created) | Q(archived_until__isnull=True)
+                    ).update(archived_until=created)
+            search.remove_items(item_ids)
+            archived += len(item_ids)
+        return archived
+
+
+class ArchivedItem(BaseItem):
+    """An item moved out of the item table by ``manage.py iris_archive``."""
+
+    id = models.PositiveIntegerField(primary_key=True)
+    topic = models.ForeignKey('Topic', related_name='archived_items')
+    content = generic.GenericForeignKey("content_type", "object_id")
+    creator = generic.GenericForeignKey("creator_content_type", "creator_object_id")
+
+    objects = ArchivedItemManager()
+
+
 class Participant(models.Model):
     """A user or other object participating in a topic."""
 
@@ -173,8 +913,11 @@ class Participant(models.Model):
     content = generic.GenericForeignKey("content_type", "object_id")
 
     item_last_read = models.ForeignKey(Item, blank=True, null=True)
+    unread_count = models.PositiveIntegerField(default=0)
     is_active = models.BooleanField(default=True)
 
+    objects = ParticipantManager()
+
     class Meta:
         unique_together = (
             ('topic', 'content_type', 'object_id'),
@@ -184,6 +927,33 @@ class Participant(models.Model):
         return unicode(self.content)
 
 
+class InboxEntry(models.Model):
+    """A topic in the inbox of one of its active participants.
+
+    This denormalizes Participant and Topic.modified so that listing a
+    participant's most recent topics needs neither a join nor a sort.
+    """
+
+    content_type = models.ForeignKey(ContentType, related_name='+')
+    object_id = models.PositiveIntegerField()
+    content = generic.GenericForeignKey("content_type", "object_id")
+
+    topic = models.ForeignKey('Topic', related_name='inbox_entries')
+    last_modified = models.DateTimeField()
+    unread_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        # Inboxes are read by (content_type, object_id, last_modified); see
+        # migration 0006 for the matching index.
+        unique_together = (
+            ('content_type', 'object_id', 'topic'),
+        )
+        verbose_name_plural = 'inbox entries'
+
+    def __unicode__(self):
+        return u"{0}: {1}".format(self.content, self.topic)
+
+
 class ParticipantJoin(models.Model):
     """Information about someone joining a conversation."""
 
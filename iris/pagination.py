@@ -0,0 +1,122 @@
+import datetime
+
+from django.db.models import Q
+
+
+CURSOR_DATETIME_FORMAT = '%Y%m%d%H%M%S%f'
+
+
+def encode_cursor(value, pk):
+    """Return an opaque cursor string for a ``(datetime, id)`` position."""
+    return '{0}-{1}'.format(value.strftime(CURSOR_DATETIME_FORMAT), pk)
+
+
+def decode_cursor(cursor):
+    """Return the ``(datetime, id)`` position encoded in a cursor.
+
+    Raises ValueError if the cursor is malformed.
+    """
+    value, pk = cursor.split('-', 1)
+    return datetime.datetime.strptime(value, CURSOR_DATETIME_FORMAT), int(pk)
+
+
+class KeysetPage(object):
+    """A page of objects in descending ``(field, id)`` order.
+
+    `object_list` is ordered newest first.  `older_cursor` and `newer_cursor`
+    are None when there are no more objects in that direction.  `cursor`
+    is the cursor the page was taken at, or None for the newest page.
+    """
+
+    def __init__(self, object_list, field, has_older, has_newer, cursor=None):
+        self.object_list = object_list
+        self.field = field
+        self.has_older = has_older
+        self.has_newer = has_newer
+        self.cursor = cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def _cursor(self, obj):
+        return encode_cursor(getattr(obj, self.field), obj.pk)
+
+    @property
+    def older_cursor(self):
+        if self.has_older and self.object_list:
+            return self._cursor(self.object_list[-1])
+
+    @property
+    def newer_cursor(self):
+        if self.has_newer and self.object_list:
+            return self._cursor(self.object_list[0])
+
+
+def _after(field, value, pk):
+    # Rows at or after the (value, pk) position.
+    return Q(**{'{0}__gt'.format(field): value}) | Q(**{field: value, 'id__gte': pk})
+
+
+def _before(field, value, pk):
+    # Rows at or before the (value, pk) position.
+    return Q(**{'{0}__lt'.format(field): value}) | Q(**{field: value, 'id__lte': pk})
+
+
+def keyset_page(queryset, field, per_page, older=None, newer=None):
+    """Return a KeysetPage of `queryset` ordered by ``(field, id)`` descending.
+
+    `older` and `newer` are cursors as returned by a previous page; pass at
+    most one of them.  Only ``per_page + 1`` rows are ever fetched, plus
+    one row on the other side of the cursor to tell whether there is
+    anything there, so the cost of a page does not depend on its position.
+    """
+    if newer is not None:
+        value, pk = decode_cursor(newer)
+        object_list = list(queryset.filter(
+            Q(**{'{0}__gt'.format(field): value}) |
+            Q(**{field: value, 'id__gt': pk})
+        ).order_by(field, 'id')[:per_page + 1])
+        has_newer = len(object_list) > per_page
+        object_list = object_list[:per_page]
+        object_list.reverse()
+        has_older = queryset.filter(_before(field, value, pk)).order_by().exists()
+        return KeysetPage(object_list, field, has_older=has_older, has_newer=has_newer, cursor=newer)
+    has_newer = False
+    if older is not None:
+        value, pk = decode_cursor(older)
+        has_newer = queryset.filter(_after(field, value, pk)).order_by().exists()
+        queryset = queryset.filter(
+            Q(**{'{0}__lt'.format(field): value}) |
+            Q(**{field: value, 'id__lt': pk})
+        )
+    queryset = queryset.order_by('-' + field, '-id')
+    object_list = list(queryset[:per_page + 1])
+    has_older = len(object_list) > per_page
+    object_list = object_list[:per_page]
+    return KeysetPage(object_list, field, has_older=has_older, has_newer=has_newer, cursor=older)
+
+
+def merge_pages(pages, per_page, newer=False):
+    """Merge KeysetPages taken at the same position of several querysets into one.
+
+    Set `newer` if the pages were taken with a `newer` cursor.
+    """
+    field = pages[0].field
+    objects = sorted(
+        [obj for page in pages for obj in page.object_list],
+        key=lambda obj: (getattr(obj, field), obj.pk),
+        reverse=True,
+    )
+    more = len(objects) > per_page
+    has_older = any(page.has_older for page in pages)
+    has_newer = any(page.has_newer for page in pages)
+    cursor = pages[0].cursor
+    if newer:
+        # The objects nearest the cursor are the oldest ones.
+        return KeysetPage(objects[-per_page:], field, has_older=has_older, has_newer=has_newer or more,
+                          cursor=cursor)
+    return KeysetPage(objects[:per_page], field, has_older=has_older or more, has_newer=has_newer,
+                      cursor=cursor)
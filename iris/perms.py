@@ -0,0 +1,117 @@
+"""Permission checks over whole querysets.
+
+An authentication backend may implement::
+
+    def filter_viewable(self, user_obj, perm, queryset):
+        ...
+
+returning the objects of `queryset` for which `user_obj` has `perm`.  This
+lets listings push permission checks into SQL instead of calling
+`has_perm` once per object.
+
+`has_perm` in this module memoizes `User.has_perm` results on the user
+object, so that repeated checks of the same permission and object during
+a request go through the backends only once.  PermissionCacheMiddleware
+drops the memo at the end of each request.
+"""
+from operator import or_
+
+from django.contrib import auth
+from django.contrib.auth.backends import ModelBackend
+
+
+def filter_viewable(user, perm, queryset):
+    """Return the objects of `queryset` for which `user` has `perm`.
+
+    Backends are combined the same way as `User.has_perm`: an object is
+    included if any backend grants the permission.  Returns None if some
+    backend can only answer object by object, in which case callers should
+    fall back to `has_perm`.
+    """
+    if user.is_active and user.is_superuser:
+        return queryset
+    querysets = []
+    for backend in auth.get_backends():
+        if not (user.is_anonymous() or user.is_active or getattr(backend, 'supports_inactive_user', False)):
+            continue
+        if hasattr(backend, 'filter_viewable'):
+            querysets.append(backend.filter_viewable(user, perm, queryset))
+        elif isinstance(backend, ModelBackend):
+            # ModelBackend never grants permissions on individual objects.
+            continue
+        elif hasattr(backend, 'has_perm'):
+            return None
+    if not querysets:
+        return queryset.none()
+    return reduce(or_, querysets)
+
+
+class PermissionCache(object):
+    """Memoized `has_perm` results for one user."""
+
+    def __init__(self, user):
+        self.user = user
+        self._results = {}
+
+    def has_perm(self, perm, obj=None):
+        if obj is not None and obj.pk is None:
+            return self.user.has_perm(perm, obj)
+        key = self._key(perm, obj)
+        try:
+            return self._results[key]
+        except KeyError:
+            result = self._results[key] = self.user.has_perm(perm, obj)
+            return result
+
+    def prefetch(self, perm, objects):
+        """Look up `perm` for all of `objects` in one pass where backends allow."""
+        objects = [obj for obj in objects if self._key(perm, obj) not in self._results]
+        if not objects:
+            return
+        model = objects[0].__class__
+        viewable = filter_viewable(self.user, perm, model._default_manager.filter(
+            pk__in=[obj.pk for obj in objects]))
+        if viewable is None:
+            for obj in objects:
+                self.has_perm(perm, obj)
+        else:
+            pks = set(viewable.values_list('pk', flat=True))
+            for obj in objects:
+                self._results[self._key(perm, obj)] = obj.pk in pks
+
+    def _key(self, perm, obj):
+        if obj is None:
+            return (perm, None, None)
+        return (perm, obj.__class__, obj.pk)
+
+
+def get_permission_cache(user):
+    """Return the PermissionCache attached to `user`, creating it as needed."""
+    cache = getattr(user, '_iris_permission_cache', None)
+    if cache is None:
+        cache = user._iris_permission_cache = PermissionCache(user)
+    return cache
+
+
+def has_perm(user, perm, obj=None):
+    """Return `user.has_perm(perm, obj)`, memoized for the life of the user object."""
+    return get_permission_cache(user).has_perm(perm, obj)
+
+
+def prefetch_perms(user, perm, objects):
+    """Memoize `perm` for each of `objects`, filtering in SQL where backends allow."""
+    get_permission_cache(user).prefetch(perm, objects)
+
+
+class PermissionCacheMiddleware(object):
+    """Limits memoized permissions to the request they were looked up in."""
+
+    def process_response(self, request, response):
+        user = getattr(request, 'user', None)
+        # AuthenticationMiddleware sets a SimpleLazyObject, whose own
+        # __dict__ never holds the memo.  Unwrapping it rather than using
+        # getattr() leaves a user that was never loaded unloaded.
+        user = getattr(user, '__dict__', {}).get('_wrapped', user)
+        if '_iris_permission_cache' in getattr(user, '__dict__', {}):
+            del user._iris_permission_cache
+        return response
@@ -1,3 +1,5 @@
+import re
+
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
 from django import forms
@@ -30,4 +32,44 @@ class ParticipantAddUserPlugin(ItemTypePlugin):
 
     label = u'participant'
     name = 'iris.participantjoin.add.user'
+    content_type = 'iris.participantjoin'
     form_class = ParticipantAddUserForm
+
+    def serialize(self, obj):
+        from iris.serializers import serialize_reference
+        return dict(participant=serialize_reference(obj.participant.content))
+
+
+class ParticipantAddUsersForm(PluginForm):
+
+    usernames = forms.CharField(
+        widget=forms.Textarea,
+        help_text='Separate names with commas or spaces.',
+    )
+
+    def clean_usernames(self):
+        usernames = [name for name in re.split(r'[\s,]+', self.cleaned_data['usernames']) if name]
+        if not usernames:
+            raise ValidationError('Please enter at least one name.')
+        users = list(User.objects.filter(username__in=usernames))
+        missing = set(usernames) - set(user.username for user in users)
+        if missing:
+            raise ValidationError('Could not find users by these names: {0}'.format(
+                ', '.join(sorted(missing))))
+        return users
+
+    def save(self):
+        items = self._topic.add_participants(
+            creator=self._request.user,
+            objs=self.cleaned_data['usernames'],
+        )
+        if items:
+            return items[-1]
+
+
+class ParticipantAddUsersPlugin(ParticipantAddUserPlugin):
+
+    label = u'participants'
+    action_label = u'Add participants'
+    name = 'iris.participantjoin.add.users'
+    form_class = ParticipantAddUsersForm
@@ -0,0 +1,150 @@
+"""A lazily loaded registry of item type plugins.
+
+``IRIS_ITEM_TYPE_PLUGINS`` names plugin classes by dotted path.  Rather
+than importing them all when `iris.conf.settings` is imported, a
+PluginRegistry imports each one the first time it is needed: iterating
+over the registry loads them all, while looking a plugin up by name loads
+them in order only until it is found.  A plugin that fails to load is
+logged to the ``iris.plugins`` logger and left out, instead of taking the
+process down with it.
+
+`iris.conf.settings.ITEM_TYPE_PLUGINS` is the registry itself, and
+`iris.conf.settings.ITEM_TYPE_PLUGINS_BY_NAME` a mapping view of it.
+Plugins may be added at runtime::
+
+    from iris.conf import settings
+    settings.ITEM_TYPE_PLUGINS.register(MyPlugin)
+"""
+import logging
+import threading
+from UserDict import DictMixin
+
+from django.utils.importlib import import_module
+
+
+logger = logging.getLogger('iris.plugins')
+
+
+class PluginRegistry(object):
+    """An ordered collection of item type plugin instances, loaded on first use.
+
+    Entries are dotted paths, plugin classes or plugin instances.
+    """
+
+    def __init__(self, entries=()):
+        self._entries = list(entries)
+        # Entries before this index have been resolved to instances, or to
+        # None if they failed to load.
+        self._resolved = 0
+        self._lock = threading.RLock()
+        self.by_name = PluginsByName(self)
+
+    def _load(self, entry):
+        if isinstance(entry, basestring):
+            modname, classname = entry.rsplit('.', 1)
+            entry = getattr(import_module(modname), classname)
+        if isinstance(entry, type):
+            entry = entry()
+        return entry
+
+    def _resolve(self, index):
+        entry = self._entries[index]
+        try:
+            plugin = self._load(entry)
+        except Exception:
+            logger.exception('Could not load item type plugin %r.', entry)
+            plugin = None
+        self._entries[index] = plugin
+        return plugin
+
+    def _resolve_all(self):
+        with self._lock:
+            while self._resolved < len(self._entries):
+                self._resolve(self._resolved)
+                self._resolved += 1
+
+    def get(self, name, default=None):
+        """Return the plugin named `name`, loading plugins only until it is found."""
+        with self._lock:
+            for plugin in self._entries[:self._resolved]:
+                if plugin is not None and plugin.name == name:
+                    return plugin
+            while self._resolved < len(self._entries):
+                plugin = self._resolve(self._resolved)
+                self._resolved += 1
+                if plugin is not None and plugin.name == name:
+                    return plugin
+        return default
+
+    def register(self, plugin):
+        """Add a plugin, given as a dotted path, class or instance, and return the instance.
+
+        It replaces any plugin of the same name in place, and otherwise
+        goes last.  Unlike plugins named in settings, errors loading it are
+        raised.
+        """
+        plugin = self._load(plugin)
+        with self._lock:
+            self._resolve_all()
+            for index, existing in enumerate(self._entries):
+                if existing is not None and existing.name == plugin.name:
+                    self._entries[index] = plugin
+                    break
+            else:
+                self._entries.append(plugin)
+                self._resolved += 1
+        return plugin
+
+    def unregister(self, name):
+        """Remove the plugin named `name`.  Raises KeyError if there is none."""
+        with self._lock:
+            plugin = self.get(name)
+            if plugin is None:
+                raise KeyError(name)
+            index = self._entries.index(plugin)
+            del self._entries[index]
+            self._resolved -= 1
+
+    def __iter__(self):
+        self._resolve_all()
+        return iter([plugin for plugin in self._entries if plugin is not None])
+
+    def __len__(self):
+        return len(list(iter(self)))
+
+    def __getitem__(self, index):
+        return list(iter(self))[index]
+
+    def __repr__(self):
+        return '<PluginRegistry {0!r}>'.format(self._entries)
+
+
+class PluginsByName(DictMixin):
+    """A mapping of plugin names to the plugins of a PluginRegistry.
+
+    Setting a name registers the plugin; deleting one unregisters it.
+    """
+
+    def __init__(self, registry):
+        self.registry = registry
+
+    def __getitem__(self, name):
+        plugin = self.registry.get(name)
+        if plugin is None:
+            raise KeyError(name)
+        return plugin
+
+    def __contains__(self, name):
+        return self.registry.get(name) is not None
+
+    def __setitem__(self, name, plugin):
+        plugin = self.registry._load(plugin)
+        if plugin.name != name:
+            raise ValueError('The plugin {0!r} is named {1!r}.'.format(plugin, plugin.name))
+        self.registry.register(plugin)
+
+    def __delitem__(self, name):
+        self.registry.unregister(name)
+
+    def keys(self):
+        return [plugin.name for plugin in self.registry]
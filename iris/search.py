@@ -0,0 +1,240 @@
+"""Full-text search over topic subjects and item content.
+
+Items are indexed as they are added by `Topic.add_item`, using the
+`search_text` method of the plugin that adds their content type, and
+removed by `Item.delete` and ``manage.py iris_archive``; topic subjects
+are indexed when topics are saved.  The ``iris_reindex``
+management command rebuilds the index from scratch.
+
+The index lives in the backend named by ``IRIS_SEARCH_BACKEND``.  The
+default, SQLiteSearchBackend, keeps an SQLite FTS5 table in the file
+named by ``IRIS_SEARCH_INDEX_PATH``.  Another backend needs the same
+methods: `index`, `remove`, `clear` and `search`.
+
+The index is not part of the database transaction, so hits for items that
+were rolled back are possible; `search_topics` shows their topics alone.
+"""
+import logging
+import sqlite3
+import threading
+
+from django.contrib.contenttypes.models import ContentType
+from django.utils.importlib import import_module
+
+from iris.conf import settings
+from iris.perms import filter_viewable, has_perm, prefetch_perms
+from iris.serializers import content_type_plugin
+
+
+logger = logging.getLogger('iris.search')
+
+
+class SQLiteSearchBackend(object):
+    """Keeps the search index in an SQLite FTS5 table.
+
+    Each entry's rowid is its item id, or the negated topic id for a topic
+    subject, so that entries are replaced and removed by primary key.
+    Hits are ranked by BM25, and a topic ranks by its best hit.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or settings.SEARCH_INDEX_PATH
+        self._local = threading.local()
+
+    def _connection(self):
+        # SQLite connections may only be used by the thread that made them.
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path)
+            connection.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS iris_search "
+                "USING fts5(text, topic_id UNINDEXED, tokenize='porter unicode61')"
+            )
+            self._local.connection = connection
+        return connection
+
+    def index(self, entries):
+        """Add or replace ``(topic_id, item_id, text)`` entries.
+
+        `item_id` is None for a topic's subject.
+        """
+        rows = [
+            (-topic_id if item_id is None else item_id, text, topic_id)
+            for topic_id, item_id, text in entries
+        ]
+        connection = self._connection()
+        with connection:
+            connection.executemany('DELETE FROM iris_search WHERE rowid = ?', [row[:1] for row in rows])
+            connection.executemany('INSERT INTO iris_search (rowid, text, topic_id) VALUES (?, ?, ?)', rows)
+
+    def remove(self, item_ids):
+        connection = self._connection()
+        with connection:
+            connection.executemany('DELETE FROM iris_search WHERE rowid = ?', [(item_id,) for item_id in item_ids])
+
+    def clear(self):
+        connection = self._connection()
+        with connection:
+            connection.execute('DELETE FROM iris_search')
+
+    def search(self, query, after=None, limit=20):
+        """Return ``(topic_id, item_id, score)`` for the best hit in each matching topic, best first.
+
+        Unless `after` is None, only topics ranked after its
+        ``(score, topic_id)`` position are returned.
+        """
+        sql = 'SELECT topic_id, rowid, MIN(rank) AS score FROM iris_search WHERE iris_search MATCH ? GROUP BY topic_id'
+        params = [match_expression(query)]
+        if after is not None:
+            sql += ' HAVING score > ? OR (score = ? AND topic_id > ?)'
+            params.extend([after[0], after[0], after[1]])
+        cursor = self._connection().execute(sql + ' ORDER BY score, topic_id LIMIT ?', params + [limit])
+        return [
+            (int(topic_id), rowid if rowid > 0 else None, score)
+            for topic_id, rowid, score in cursor
+        ]
+
+
+def encode_search_cursor(score, topic_id):
+    """Return an opaque cursor string for a ``(score, topic_id)`` position."""
+    # repr() round-trips floats exactly.
+    return '{0!r}_{1}'.format(score, topic_id)
+
+
+def decode_search_cursor(cursor):
+    """Return the ``(score, topic_id)`` position encoded in a cursor.
+
+    Raises ValueError if the cursor is malformed.
+    """
+    score, topic_id = cursor.split('_', 1)
+    return float(score), int(topic_id)
+
+
+def match_expression(query):
+    """Return an FTS5 expression that matches all of the words in `query`.
+
+    Each word is quoted, so search syntax typed by users is taken literally.
+    """
+    return u' '.join(u'"{0}"'.format(word.replace(u'"', u'""')) for word in query.split())
+
+
+_backend = None
+
+
+def get_backend():
+    """Return the backend named by ``IRIS_SEARCH_BACKEND``."""
+    global _backend
+    if _backend is None:
+        modname, classname = settings.SEARCH_BACKEND.rsplit('.', 1)
+        _backend = getattr(import_module(modname), classname)()
+    return _backend
+
+
+def item_search_text(item):
+    """Return the text to index for an item, or None."""
+    plugin = content_type_plugin(ContentType.objects.get_for_id(item.content_type_id))
+    if plugin is None or item.content is None:
+        return None
+    return plugin.search_text(item.content)
+
+
+def index_item(item):
+    """Index an item's content.  Errors are logged rather than raised."""
+    try:
+        text = item_search_text(item)
+        if text:
+            get_backend().index([(item.topic_id, item.id, text)])
+    except Exception:
+        logger.exception('Could not index item %s.', item.id)
+
+
+def remove_items(item_ids):
+    """Remove items from the index.  Errors are logged rather than raised."""
+    try:
+        get_backend().remove(item_ids)
+    except Exception:
+        logger.exception('Could not remove items %s from the index.', item_ids)
+
+
+def index_topic(topic):
+    """Index a topic's subject.  Errors are logged rather than raised."""
+    try:
+        get_backend().index([(topic.id, None, topic.subject)])
+    except Exception:
+        logger.exception('Could not index topic %s.', topic.id)
+
+
+class SearchResult(object):
+    """A topic matching a search, with its best matching item, if any."""
+
+    def __init__(self, topic, item=None, score=None):
+        self.topic = topic
+        self.item = item
+        self.score = score
+
+    @property
+    def text(self):
+        if self.item is not None:
+            return item_search_text(self.item)
+
+
+class SearchPage(object):
+    """A page of search results.  `next_cursor` is None on the last page."""
+
+    def __init__(self, results, after, next_cursor):
+        self.results = results
+        self.after = after
+        self.next_cursor = next_cursor
+
+    def __iter__(self):
+        return iter(self.results)
+
+    def __len__(self):
+        return len(self.results)
+
+
+def search_topics(user, query, after=None, per_page=None):
+    """Return a SearchPage of the topics matching `query` that `user` may view.
+
+    `after` is a cursor taken from the previous page's `next_cursor`.
+    Pages are taken by ``(score, topic_id)`` position rather than offset,
+    so that later pages do not read through the hits of earlier ones.
+    Hits are read in batches and checked for permission one batch at a
+    time.  Raises ValueError if `after` is malformed.
+    """
+    from iris.models import ArchivedItem, Item, Topic, prefetch_items
+    per_page = per_page or settings.TOPICS_PER_PAGE
+    backend = get_backend()
+    results = []
+    next_cursor = None
+    position = decode_search_cursor(after) if after is not None else None
+    while next_cursor is None:
+        hits = backend.search(query, after=position, limit=per_page * 2)
+        if not hits:
+            break
+        topics = Topic.objects.in_bulk([topic_id for topic_id, item_id, score in hits])
+        viewable = filter_viewable(user, 'iris.view_topic', Topic.objects.filter(pk__in=topics.keys()))
+        if viewable is None:
+            prefetch_perms(user, 'iris.view_topic', topics.values())
+            viewable_ids = set(
+                topic.id for topic in topics.values() if has_perm(user, 'iris.view_topic', topic))
+        else:
+            viewable_ids = set(viewable.values_list('id', flat=True))
+        item_ids = [item_id for topic_id, item_id, score in hits if item_id]
+        items = Item.objects.in_bulk(item_ids)
+        items.update(ArchivedItem.objects.in_bulk([item_id for item_id in item_ids if item_id not in items]))
+        for topic_id, item_id, score in hits:
+            if topic_id not in viewable_ids:
+                continue
+            if len(results) == per_page:
+                last = results[-1]
+                next_cursor = encode_search_cursor(last.score, last.topic.id)
+                break
+            item = items.get(item_id)
+            if item is not None:
+                item._topic_cache = topics[topic_id]
+            results.append(SearchResult(topics[topic_id], item, score))
+        topic_id, item_id, score = hits[-1]
+        position = (score, topic_id)
+    prefetch_items([result.item for result in results if result.item is not None])
+    return SearchPage(results, after, next_cursor)
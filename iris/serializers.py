@@ -0,0 +1,75 @@
+"""Plain-data representations of topics, items and participants.
+
+Each function returns a dict of JSON-serializable values.  Item content
+is serialized by the `serialize` method of the plugin that adds its
+content type; see `iris.base.ItemTypePlugin`.
+"""
+from django.contrib.contenttypes.models import ContentType
+
+from iris.conf import settings
+
+
+def serialize_datetime(value):
+    if value is None:
+        return None
+    return value.isoformat()
+
+
+def serialize_reference(obj):
+    """Return the type, id and text of an object such as a creator or participant."""
+    if obj is None:
+        return None
+    return dict(
+        type='{0}.{1}'.format(obj._meta.app_label, obj._meta.object_name.lower()),
+        id=obj.pk,
+        text=unicode(obj),
+    )
+
+
+def content_type_plugin(content_type):
+    """Return the plugin that adds items of `content_type`, or None."""
+    name = '{0}.{1}'.format(content_type.app_label, content_type.model)
+    for plugin in settings.ITEM_TYPE_PLUGINS:
+        if plugin.content_type == name:
+            return plugin
+    return None
+
+
+def serialize_topic(topic):
+    return dict(
+        id=topic.id,
+        subject=topic.subject,
+        created=serialize_datetime(topic.created),
+        modified=serialize_datetime(topic.modified),
+        creator=serialize_reference(topic.creator),
+        url=topic.get_absolute_url(),
+    )
+
+
+def serialize_participant(participant):
+    return dict(
+        id=participant.id,
+        topic=participant.topic_id,
+        content=serialize_reference(participant.content),
+        is_active=participant.is_active,
+    )
+
+
+def serialize_item(item):
+    content_type = ContentType.objects.get_for_id(item.content_type_id)
+    content = item.content
+    plugin = content_type_plugin(content_type)
+    if content is None:
+        data = None
+    elif plugin is not None:
+        data = plugin.serialize(content)
+    else:
+        data = dict(text=unicode(content))
+    return dict(
+        id=item.id,
+        topic=item.topic_id,
+        created=serialize_datetime(item.created),
+        creator=serialize_reference(item.creator),
+        type='{0}.{1}'.format(content_type.app_label, content_type.model),
+        content=data,
+    )
@@ -1,9 +1,16 @@
-from django.contrib.auth.models import AnonymousUser
+from django.contrib.auth.models import AnonymousUser, User
 from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
 from django.db import models
 from django.template import Library
+from django.template.loader import get_template
+from django.utils.safestring import mark_safe
 
-from iris.models import Item, Topic
+from iris.caching import item_fragment_key
+from iris.conf import settings
+from iris.instrumentation import query_tag
+from iris.models import Item, Topic, prefetch_items
+from iris.perms import filter_viewable, has_perm
 
 
 register = Library()
@@ -12,16 +19,18 @@ register = Library()
 @register.filter
 def activeparticipants(participants_qs):
     """Filter only active participants in a queryset of participants."""
-    return participants_qs.filter(is_active=True)
+    return participants_qs.filter(is_active=True).with_content()
 
 
 @register.filter
+@query_tag('iris_tags.canaddtotopic')
 def canaddtotopic(user, topic):
     """Return true if the user can add items to the topic."""
-    return user.has_perm('iris.add_to_topic', obj=topic)
+    return has_perm(user, 'iris.add_to_topic', topic)
 
 
 @register.filter
+@query_tag('iris_tags.canviewtopic')
 def canviewtopic(user, topic):
     """Return true if the user can view the topic.
 
@@ -31,10 +40,11 @@ def canviewtopic(user, topic):
             <li>{{ topic.subject }}</li>
         {% endif %}
     """
-    return user.has_perm('iris.view_topic', obj=topic)
+    return has_perm(user, 'iris.view_topic', topic)
 
 
 @register.filter
+@query_tag('iris_tags.canjointopic')
 def canjointopic(user, topic):
     """Return True if the user can participate in the topic.
 
@@ -44,10 +54,11 @@ def canjointopic(user, topic):
             <a href="...">Join Topic</a>
         {% endif %}
     """
-    return user.has_perm('iris.join_topic', obj=topic)
+    return has_perm(user, 'iris.join_topic', topic)
 
 
 @register.filter
+@query_tag('iris_tags.hasjoinedtopic')
 def hasjoinedtopic(obj, topic):
     """Return True if the object participates in the topic.
 
@@ -62,7 +73,45 @@ def hasjoinedtopic(obj, topic):
     return topic.has_participant(obj)
 
 
+@register.assignment_tag(takes_context=True)
+def itemfragments(context, items, template_name='iris/topic_item.html'):
+    """Return ``(item, html)`` pairs with each item rendered by `template_name`.
+
+    Renderings are kept in the cache and fetched with one round trip, and
+    only items missing from the cache have their content fetched.  Since
+    renderings are shared by all users, item templates must not depend on
+    who is looking.
+
+    Example::
+
+        {% itemfragments item_page as fragments %}
+        {% for item, html in fragments %}
+            <li>{{ html }}</li>
+        {% endfor %}
+    """
+    # Tagged in the body, since the tag's arguments are read from its signature.
+    with query_tag('iris_tags.itemfragments'):
+        items = list(items)
+        keys = [item_fragment_key(item) for item in items]
+        fragments = cache.get_many(keys)
+        missing = [item for item, key in zip(items, keys) if key not in fragments]
+        if missing:
+            prefetch_items([item for item in missing if not hasattr(item, '_content_cache')])
+            template = get_template(template_name)
+            rendered = {}
+            for item in missing:
+                context.update(dict(item=item))
+                try:
+                    rendered[item_fragment_key(item)] = template.render(context)
+                finally:
+                    context.pop()
+            cache.set_many(rendered, settings.ITEM_FRAGMENT_CACHE_TIMEOUT)
+            fragments.update(rendered)
+    return [(item, mark_safe(fragments[key])) for item, key in zip(items, keys)]
+
+
 @register.filter
+@query_tag('iris_tags.itemreferencedby')
 def itemreferencedby(obj):
     """Return the iris.item instance that references the given object as its content."""
     ct = ContentType.objects.get_for_model(obj)
@@ -84,17 +133,28 @@ def participantsoftype(obj, content_type_name=None):
     if content_type_name:
         return obj.participants_of_type(content_type_name)
     else:
-        return obj.participants.all
+        return obj.participants.with_content()
 
 
 @register.filter
-def topicsjoined(obj):
-    """Return a queryset containing Topic instances that obj participates in.
+def topicsjoined(obj, limit=None):
+    """Return a queryset containing Topic instances that obj participates in,
+    most recently modified first.
+
+    At most `limit` topics are returned, by default
+    ``IRIS_JOINED_TOPICS_LIMIT``.  When obj is a user, topics they may not
+    view are left out if the authentication backends can filter them in
+    SQL.
 
     Example::
 
-        {% for topic in user|topicsjoined %}
+        {% for topic in user|topicsjoined:10 %}
             <li>{{ topic.subject }}</li>
         {% endfor %}
     """
-    return Topic.objects.with_participant(obj)
+    topics = Topic.objects.inbox(obj)
+    if isinstance(obj, User):
+        viewable = filter_viewable(obj, 'iris.view_topic', topics)
+        if viewable is not None:
+            topics = viewable
+    return topics[:int(limit or settings.JOINED_TOPICS_LIMIT)]
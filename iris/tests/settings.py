@@ -1,3 +1,5 @@
 # Django settings for example project.
 
 from iris.example.settings import *
+
+IRIS_SEARCH_INDEX_PATH = ':memory:'
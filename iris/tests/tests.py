@@ -1,12 +1,37 @@
+import datetime
+import json
+import urlparse
+from StringIO import StringIO
 from operator import attrgetter
 
-from django.contrib.auth.models import User
+from django.conf import settings as django_settings
+from django.contrib.auth import BACKEND_SESSION_KEY, SESSION_KEY
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.cache import cache
+from django.core.urlresolvers import reverse
+from django.db import connections
+from django.http import HttpResponse
+from django.template import Context, Template
 from django.test import TestCase
+from django.test.client import RequestFactory
+from django.utils import translation
+from django.utils.functional import SimpleLazyObject
+from django.utils.importlib import import_module
 
-from iris.models import ParticipantJoin, Topic
+from iris import benchmarks, events, search, views
+from iris.caching import item_fragment_key, roster_cache_key
+from iris.coalesce import modified_buffer
+from iris.conf import settings
+from iris.hub import ItemHub, hub
+from iris.instrumentation import HEADER, QueryAssertionsMixin, QueryInstrumentationMiddleware
+from iris.models import ArchivedItem, Item, ParticipantJoin, ParticipantLeave, Topic
+from iris.pagination import encode_cursor
+from iris.perms import PermissionCacheMiddleware, filter_viewable, has_perm, prefetch_perms
+from iris.registry import PluginRegistry
+from iris.transfer import Importer, export_ndjson
 
 
-class IrisTest(TestCase):
+class IrisTest(QueryAssertionsMixin, TestCase):
     """Tests for django-iris."""
 
     def setUp(self):
@@ -16,11 +41,24 @@ class IrisTest(TestCase):
         self.bob, created = User.objects.get_or_create(username='bob')
         if created:
             self.bob.save()
+        # Topic and item ids are reused once each test rolls back.
+        hub._latest.clear()
+        cache.clear()
+        events.discard()
+        search.get_backend().clear()
 
     def tearDown(self):
         del self.alice
         del self.bob
 
+    def login(self, user):
+        # ContrivedBackend cannot authenticate, so log in through the session.
+        session = import_module(django_settings.SESSION_ENGINE).SessionStore()
+        session[SESSION_KEY] = user.id
+        session[BACKEND_SESSION_KEY] = 'django.contrib.auth.backends.ModelBackend'
+        session.save()
+        self.client.cookies[django_settings.SESSION_COOKIE_NAME] = session.session_key
+
     def test_create_topic(self):
         # alice starts a topic with a subject
         subject = 'Aardvarks'
@@ -92,3 +130,826 @@ class IrisTest(TestCase):
         assert topic.has_participant(self.bob)
         #
         assert topic.item_last_read_by(self.bob) == None
+
+    def test_item_page(self):
+        # - alice starts a topic and posts a handful of items
+        topic = Topic(
+            subject='Armadillos',
+            creator=self.alice,
+        )
+        topic.save()
+        topic.add_participant(
+            creator=self.alice,
+            obj=self.alice,
+        )
+        created = datetime.datetime(2011, 1, 1)
+        for i in range(4):
+            # items share timestamps so that ids break the ties
+            item = Item(topic=topic, creator=self.alice, content=self.bob, created=created)
+            item.save()
+        items = list(topic.items.order_by('-created', '-id'))
+        assert len(items) == 5
+        #
+        # - the first page holds the newest items
+        page = topic.item_page(per_page=2)
+        assert page.object_list == items[0:2]
+        assert page.has_older and not page.has_newer
+        assert page.newer_cursor is None
+        #
+        # - paging older follows the (created, id) order
+        page = topic.item_page(older=page.older_cursor, per_page=2)
+        assert page.object_list == items[2:4]
+        assert page.has_older and page.has_newer
+        last_page = topic.item_page(older=page.older_cursor, per_page=2)
+        assert last_page.object_list == items[4:5]
+        assert not last_page.has_older
+        #
+        # - paging newer returns to where we came from
+        page = topic.item_page(newer=last_page.newer_cursor, per_page=2)
+        assert page.object_list == items[2:4]
+        #
+        # - an item's url leads to the page that starts with it
+        query = urlparse.urlparse(items[3].get_absolute_url()).query
+        page = topic.item_page(older=urlparse.parse_qs(query)['older'][0], per_page=2)
+        assert page.object_list == items[3:5]
+        #
+        # - the newest item's page knows that nothing is newer
+        query = urlparse.urlparse(items[0].get_absolute_url()).query
+        page = topic.item_page(older=urlparse.parse_qs(query)['older'][0], per_page=2)
+        assert page.object_list == items[0:2]
+        assert page.has_older and not page.has_newer
+        #
+        # - past the newest item, the page is empty and offers no cursors
+        page = topic.item_page(newer=encode_cursor(items[0].created, items[0].id), per_page=2)
+        assert page.object_list == [] and not page.has_newer
+        assert page.older_cursor is None and page.newer_cursor is None
+
+    def test_items_with_related(self):
+        # - alice starts a topic and adds bob
+        topic = Topic(
+            subject='Axolotls',
+            creator=self.alice,
+        )
+        topic.save()
+        topic.add_participant(
+            creator=self.alice,
+            obj=self.alice,
+        )
+        topic.add_participant(
+            creator=self.alice,
+            obj=self.bob,
+        )
+        #
+        # - rendering joins costs one query per relation, not per item:
+        #   items, joins, creators, participants and participant contents
+        with self.assertNumQueries(5):
+            items = list(topic.items.with_related())
+            for item in items:
+                item.content_type
+                item.creator
+                item.content.participant.content
+        assert [item.content.participant.content for item in items] == [self.alice, self.bob]
+        #
+        # - likewise for participants
+        with self.assertNumQueries(2):
+            participants = list(topic.participants.with_content())
+            assert set(p.content for p in participants) == set([self.alice, self.bob])
+
+    def test_add_item_query_budget(self):
+        topic = Topic(
+            subject='Anteaters',
+            creator=self.alice,
+        )
+        topic.save()
+        topic.add_participant(
+            creator=self.alice,
+            obj=self.alice,
+        )
+        # - posting an item is one INSERT plus UPDATEs of the topic, of its
+        #   inbox entries and of its participants' unread counts
+        with self.assertNumQueries(5):
+            item = topic.add_item(creator=self.alice, obj=self.bob)
+        assert topic.modified == item.created
+        assert Topic.objects.get(pk=topic.pk).modified == item.created
+        #
+        # - an item created in the past never moves modified backwards
+        modified = topic.modified
+        item = Item(topic=topic, creator=self.alice, content=self.bob,
+                    created=datetime.datetime(2000, 1, 1))
+        item.save()
+        assert topic.modified == modified
+        assert Topic.objects.get(pk=topic.pk).modified == modified
+
+    def test_coalesced_modified(self):
+        topic = Topic(
+            subject='Aye-ayes',
+            creator=self.alice,
+        )
+        topic.save()
+        settings.COALESCE_TOPIC_MODIFIED = True
+        try:
+            # - posting records the timestamp and counts in the buffer
+            #   without writing to the topic row
+            modified = topic.modified
+            with self.assertNumQueries(3):
+                item = topic.add_item(creator=self.alice, obj=self.bob)
+            stored = Topic.objects.get(pk=topic.pk)
+            assert (stored.modified, stored.item_count, stored.last_item_id) == (modified, 0, None)
+            #
+            # - flushing writes them to the topic
+            assert modified_buffer.flush() == 1
+            stored = Topic.objects.get(pk=topic.pk)
+            assert (stored.modified, stored.item_count, stored.last_item_id) == (item.created, 1, item.id)
+            assert modified_buffer.flush() == 0
+        finally:
+            settings.COALESCE_TOPIC_MODIFIED = False
+
+    def test_add_participants(self):
+        clara, created = User.objects.get_or_create(username='clara')
+        topic = Topic(
+            subject='Alpacas',
+            creator=self.alice,
+        )
+        topic.save()
+        topic.add_participant(
+            creator=self.alice,
+            obj=self.alice,
+        )
+        # - bob once participated but is no longer active
+        topic.add_participant(
+            creator=self.alice,
+            obj=self.bob,
+        )
+        topic.participants.filter(object_id=self.bob.id).update(is_active=False, unread_count=3)
+        #
+        # - alice adds everyone at once; only bob and clara join
+        with self.assertNumQueries(15):
+            items = topic.add_participants(
+                creator=self.alice,
+                objs=[self.alice, self.bob, clara, clara],
+            )
+        assert [unicode(item) for item in items] == [u'alice: bob joined', u'alice: clara joined']
+        assert topic.modified == items[-1].created
+        assert Topic.objects.get(pk=topic.pk).modified == items[-1].created
+        assert topic.has_participant(self.bob)
+        assert topic.has_participant(clara)
+        assert topic.participants.count() == 3
+        assert topic.participants.get(object_id=self.bob.id).unread_count == 0
+        #
+        # - adding them again does nothing
+        assert topic.add_participants(creator=self.alice, objs=[self.bob, clara]) == []
+
+    def test_unread_counts(self):
+        topic = Topic(
+            subject='Albatrosses',
+            creator=self.alice,
+        )
+        topic.save()
+        topic.add_participants(
+            creator=self.alice,
+            objs=[self.alice, self.bob],
+        )
+        topic.mark_read(self.bob)
+        #
+        # - items count as unread for everyone but their creator
+        first = topic.add_item(creator=self.alice, obj=self.bob)
+        topic.add_item(creator=self.alice, obj=self.bob)
+        assert topic.get_participant(self.alice).unread_count == 0
+        assert topic.get_participant(self.bob).unread_count == 2
+        assert Topic.objects.with_participant(self.bob)[0].unread_count == 2
+        #
+        # - reading advances the marker and recomputes the count
+        assert topic.mark_read(self.bob, first)
+        assert topic.get_participant(self.bob).unread_count == 1
+        assert topic.item_last_read_by(self.bob) == first
+        assert topic.mark_read(self.bob)
+        assert topic.get_participant(self.bob).unread_count == 0
+        #
+        # - the marker never moves backwards
+        assert not topic.mark_read(self.bob, first)
+        assert topic.item_last_read_by(self.bob) != first
+        #
+        # - recounting leaves out the reader's own items, too
+        topic.add_item(creator=self.bob, obj=self.alice)
+        assert topic.mark_read(self.alice, first)
+        assert topic.get_participant(self.alice).unread_count == 1
+
+    def test_items_stream(self):
+        # ContrivedBackend lets anonymous users view topics clara hasn't joined.
+        User.objects.get_or_create(username='clara')
+        topic = Topic(
+            subject='Aardwolves',
+            creator=self.alice,
+        )
+        topic.save()
+        first = topic.add_participant(
+            creator=self.alice,
+            obj=self.alice,
+        )
+        hub.start()
+        # - waiting times out while nothing is posted
+        assert hub.wait(topic.id, first.id, timeout=0.01) is None
+        #
+        # - a new item wakes waiters with its id
+        item = topic.add_item(creator=self.alice, obj=ParticipantJoin.objects.get())
+        events.flush()
+        assert hub.wait(topic.id, first.id, timeout=0.01) == item.id
+        #
+        # - the stream sends the new item as an event, then keeps alive
+        timeout, heartbeat = settings.STREAM_TIMEOUT, settings.STREAM_HEARTBEAT
+        settings.STREAM_TIMEOUT, settings.STREAM_HEARTBEAT = 0.5, 0.01
+        try:
+            response = self.client.get(first.get_items_stream_url())
+            content = ''.join(response)
+        finally:
+            settings.STREAM_TIMEOUT, settings.STREAM_HEARTBEAT = timeout, heartbeat
+        assert response['Content-Type'] == 'text/event-stream'
+        assert 'id: {0}\ndata: '.format(item.id) in content
+        assert 'id="i{0}"'.format(item.id) in content
+        assert 'id="i{0}"'.format(first.id) not in content
+        assert ': keep-alive' in content
+        #
+        # - non-ASCII items are sent, and a malformed Last-Event-ID is ignored
+        zoe = User.objects.create(username=u'zo\xeb')
+        joined = topic.add_participant(creator=self.alice, obj=zoe)
+        events.flush()
+        settings.STREAM_TIMEOUT, settings.STREAM_HEARTBEAT = 0.1, 0.01
+        try:
+            response = self.client.get(item.get_items_stream_url(), HTTP_LAST_EVENT_ID='bogus')
+            content = ''.join(response)
+        finally:
+            settings.STREAM_TIMEOUT, settings.STREAM_HEARTBEAT = timeout, heartbeat
+        assert 'id: {0}\ndata: '.format(joined.id) in content
+        assert u'zo\xeb'.encode('utf-8') in content
+        #
+        # - items the hub has not heard of are read from the database
+        hub._latest.clear()
+        settings.STREAM_TIMEOUT, settings.STREAM_HEARTBEAT = 0.05, 0.01
+        try:
+            content = ''.join(self.client.get(item.get_items_stream_url()))
+        finally:
+            settings.STREAM_TIMEOUT, settings.STREAM_HEARTBEAT = timeout, heartbeat
+        assert 'id: {0}\ndata: '.format(joined.id) in content
+        #
+        # - the hub forgets the least recently updated topics
+        small = ItemHub(2)
+        for topic_id in (1, 2, 1, 3):
+            small.publish(topic_id, 10)
+        assert small._latest.keys() == [1, 3]
+
+    def test_item_added_event(self):
+        received = []
+        def receiver(sender, **kwargs):
+            received.append(kwargs)
+        events.connect(receiver)
+        try:
+            topic = Topic(
+                subject='Anoles',
+                creator=self.alice,
+            )
+            topic.save()
+            # - events wait for the test's transaction to commit
+            item = topic.add_participant(
+                creator=self.alice,
+                obj=self.alice,
+            )
+            assert received == []
+            events.flush()
+            assert len(received) == 1
+            assert received[0]['topic_id'] == topic.id
+            assert received[0]['item_id'] == item.id
+            assert received[0]['content_type_id'] == item.content_type_id
+            #
+            # - events that cannot be sent are dropped instead of raised
+            transport, events._transport = events._transport, events.RedisTransport(host='127.0.0.1', port=1)
+            try:
+                topic.add_participant(creator=self.alice, obj=self.bob)
+                events.flush()
+            finally:
+                events._transport = transport
+            events.flush()
+            assert len(received) == 1
+        finally:
+            events.item_added.disconnect(receiver)
+
+    def test_filter_viewable(self):
+        clara, created = User.objects.get_or_create(username='clara')
+        public = Topic(subject='Asps', creator=self.alice)
+        public.save()
+        public.add_participant(creator=self.alice, obj=self.alice)
+        private = Topic(subject='Adders', creator=clara)
+        private.save()
+        private.add_participant(creator=clara, obj=clara)
+        # - ContrivedBackend hides clara's topics from anonymous users in SQL
+        anonymous = AnonymousUser()
+        with self.assertNumQueries(1):
+            topics = list(filter_viewable(anonymous, 'iris.view_topic', Topic.objects.all()))
+        assert topics == [public]
+        assert [anonymous.has_perm('iris.view_topic', topic) for topic in (public, private)] == [True, False]
+        #
+        # - the topic list needs no per-topic permission checks
+        response = self.client.get(reverse('iris_topics'))
+        assert 'Asps' in response.content
+        assert 'Adders' not in response.content
+        assert '(restricted)' not in response.content
+        #
+        # - superusers see everything
+        self.alice.is_superuser = True
+        assert filter_viewable(self.alice, 'iris.view_topic', Topic.objects.all()).count() == 2
+
+    def test_permission_cache(self):
+        clara, created = User.objects.get_or_create(username='clara')
+        topic = Topic(subject='Asses', creator=self.alice)
+        topic.save()
+        anonymous = AnonymousUser()
+        # - the first check goes through the backends, later ones don't
+        with self.assertNumQueries(2):
+            assert has_perm(anonymous, 'iris.view_topic', topic)
+            assert has_perm(anonymous, 'iris.view_topic', topic)
+            assert has_perm(anonymous, 'iris.view_topic', topic)
+        #
+        # - a whole list can be looked up at once
+        other = Topic(subject='Avocets', creator=clara)
+        other.save()
+        other.add_participant(creator=clara, obj=clara)
+        anonymous = AnonymousUser()
+        with self.assertNumQueries(1):
+            prefetch_perms(anonymous, 'iris.view_topic', [topic, other])
+            assert has_perm(anonymous, 'iris.view_topic', topic)
+            assert not has_perm(anonymous, 'iris.view_topic', other)
+        #
+        # - the memo is dropped at the end of the request, lazy user or not
+        request = RequestFactory().get('/')
+        request.user = SimpleLazyObject(AnonymousUser)
+        has_perm(request.user, 'iris.view_topic', topic)
+        assert hasattr(request.user, '_iris_permission_cache')
+        PermissionCacheMiddleware().process_response(request, None)
+        assert not hasattr(request.user, '_iris_permission_cache')
+
+    def test_inbox(self):
+        first = Topic(subject='Agoutis', creator=self.alice)
+        first.save()
+        first.add_participants(creator=self.alice, objs=[self.alice, self.bob])
+        second = Topic(subject='Addaxes', creator=self.alice)
+        second.save()
+        second.add_participant(creator=self.alice, obj=self.alice)
+        # - the most recently modified topic comes first
+        assert list(Topic.objects.inbox(self.alice)) == [second, first]
+        assert list(Topic.objects.inbox(self.bob)) == [first]
+        #
+        # - new items move topics up and count as unread for others
+        first.add_item(creator=self.alice, obj=self.bob)
+        inbox = list(Topic.objects.inbox(self.alice))
+        assert inbox == [first, second]
+        assert [topic.unread_count for topic in inbox] == [0, 0]
+        assert Topic.objects.inbox(self.bob)[0].unread_count == 1
+        first.mark_read(self.bob)
+        assert Topic.objects.inbox(self.bob)[0].unread_count == 0
+        #
+        # - "Your topics" lists at most IRIS_JOINED_TOPICS_LIMIT of them
+        template = Template('{% load iris_tags %}{% for topic in user|topicsjoined %}{{ topic.subject }} {% endfor %}')
+        limit = settings.JOINED_TOPICS_LIMIT
+        settings.JOINED_TOPICS_LIMIT = 1
+        self.alice.is_superuser = True
+        try:
+            assert template.render(Context(dict(user=self.alice))) == 'Agoutis '
+        finally:
+            settings.JOINED_TOPICS_LIMIT = limit
+
+    def test_topics_page(self):
+        User.objects.get_or_create(username='clara')
+        topics = []
+        for subject in ['Asps', 'Adders', 'Anacondas']:
+            topic = Topic(subject=subject, creator=self.alice)
+            topic.save()
+            topics.append(topic)
+        url = reverse('iris_topics')
+        # - the newest topics come first, a page at a time
+        settings.TOPICS_PER_PAGE = 2
+        try:
+            response = self.client.get(url)
+            assert list(response.context['topic_page']) == [topics[2], topics[1]]
+            older = response.context['topic_page'].older_cursor
+            response = self.client.get(url, dict(older=older))
+            assert list(response.context['topic_page']) == [topics[0]]
+            #
+            # - the first page is cached until an item is added
+            with self.assertNumQueries(0):
+                response = self.client.get(url)
+            assert list(response.context['topic_page']) == [topics[2], topics[1]]
+            topics[0].add_item(creator=self.alice, obj=self.bob)
+            response = self.client.get(url)
+            assert list(response.context['topic_page']) == [topics[0], topics[2]]
+        finally:
+            settings.TOPICS_PER_PAGE = 50
+
+    def test_item_fragments(self):
+        topic = Topic(subject='Aphids', creator=self.alice)
+        topic.save()
+        topic.add_participants(creator=self.alice, objs=[self.alice, self.bob])
+        template = Template('{% load iris_tags %}{% itemfragments items as fragments %}'
+                            '{% for item, html in fragments %}{{ html }}{% endfor %}')
+        # - the first rendering fetches content and fills the cache
+        items = list(topic.items.all())
+        html = template.render(Context(dict(items=items)))
+        assert 'bob' in html
+        #
+        # - later renderings need nothing but the items
+        items = list(topic.items.all())
+        with self.assertNumQueries(0):
+            assert template.render(Context(dict(items=items))) == html
+        #
+        # - a new plugin view version changes the keys
+        key = item_fragment_key(items[0])
+        plugin = settings.ITEM_TYPE_PLUGINS_BY_NAME['iris.participantjoin.add.user']
+        plugin.view_version += 1
+        try:
+            assert item_fragment_key(items[0]) != key
+        finally:
+            plugin.view_version -= 1
+        #
+        # - so does the language
+        with translation.override('fr'):
+            assert item_fragment_key(items[0]) != key
+
+    def test_roster(self):
+        topic = Topic(subject='Antelopes', creator=self.alice)
+        topic.save()
+        topic.add_participant(creator=self.alice, obj=self.alice)
+        # - the roster is read once, then every check is answered from memory
+        with self.assertNumQueries(1):
+            assert topic.has_participant(self.alice)
+            assert not topic.has_participant(self.bob)
+            assert topic.get_participant(self.bob) is None
+        #
+        # - another instance of the topic reads the roster from the cache
+        other = Topic.objects.get(pk=topic.pk)
+        with self.assertNumQueries(0):
+            assert other.has_participant(self.alice)
+        #
+        # - joining invalidates the roster
+        key = roster_cache_key(topic.pk)
+        stale = Topic.objects.get(pk=topic.pk).roster
+        topic.add_participants(creator=self.alice, objs=[self.bob])
+        assert topic.has_participant(self.bob)
+        assert Topic.objects.get(pk=topic.pk).has_participant(self.bob)
+        #
+        # - so a roster read before the join and cached after it is not used
+        cache.set(key, stale)
+        assert Topic.objects.get(pk=topic.pk).has_participant(self.bob)
+
+    def test_remove_participant(self):
+        topics = []
+        for subject in ['Bats', 'Bears', 'Beavers']:
+            topic = Topic(subject=subject, creator=self.alice)
+            topic.save()
+            topic.add_participants(creator=self.alice, objs=[self.alice, self.bob])
+            topics.append(topic)
+        # - bob leaves one topic
+        item = topics[0].remove_participant(self.bob, self.bob)
+        assert isinstance(item.content, ParticipantLeave)
+        assert not topics[0].has_participant(self.bob)
+        assert topics[0].get_participant(self.alice).unread_count == 1
+        assert topics[0].remove_participant(self.bob, self.bob) is None
+        #
+        # - then the rest with a fixed number of queries
+        with self.assertNumQueries(12):
+            items = Topic.objects.remove_participant(self.bob, self.bob)
+        assert len(items) == 2
+        assert not Topic.objects.inbox(self.bob).exists()
+        assert [topic.has_participant(self.bob) for topic in Topic.objects.all()] == [False] * 3
+        assert list(Topic.objects.inbox(self.alice)) == list(reversed(topics[1:])) + [topics[0]]
+        #
+        # - older_than only leaves topics not modified since
+        topics[2].add_participant(self.bob, self.bob)
+        assert not Topic.objects.remove_participant(self.bob, self.bob, older_than=topics[1].modified)
+        assert len(Topic.objects.remove_participant(self.alice, self.alice, older_than=topics[2].modified)) == 2
+        #
+        # - leaving twice at once, as with a double submit, redirects to the topic
+        topics[0].add_participant(self.bob, self.bob)
+        roster = topics[0].roster
+        Topic.objects.remove_participant(self.bob, self.bob, topics=[topics[0]])
+        # The second request read the roster before the first left.
+        cache.set(roster_cache_key(topics[0].id), roster)
+        self.login(self.bob)
+        url = reverse('iris_topic_leave', kwargs=dict(topic_id=topics[0].id))
+        response = self.client.post(url)
+        assert response['Location'].endswith(topics[0].get_absolute_url())
+
+    def test_items_sync(self):
+        clara, created = User.objects.get_or_create(username='clara')
+        topics = []
+        for subject in ['Caribou', 'Cheetahs', 'Chipmunks']:
+            topic = Topic(subject=subject, creator=self.alice)
+            topic.save()
+            topic.add_participant(creator=self.alice, obj=self.alice)
+            topics.append(topic)
+        first = [topic.items.get() for topic in topics]
+        # - anonymous users may not view topics clara has joined
+        topics[2].add_participant(creator=clara, obj=clara)
+        later = topics[0].add_participant(creator=self.alice, obj=self.bob)
+        url = '{0}?t={1}:{2}&t={3}:{4}&t={5}:{6}'.format(
+            reverse('iris_items_sync'),
+            topics[0].id, first[0].id,
+            topics[1].id, first[1].id,
+            topics[2].id, first[2].id,
+        )
+        response = self.client.get(url)
+        result = json.loads(response.content)
+        assert result['more'] is False
+        assert result['topics'].keys() == [str(topics[0].id)]
+        assert result['topics'][str(topics[0].id)]['last_item_id'] == later.id
+        assert 'id="i{0}"'.format(later.id) in result['topics'][str(topics[0].id)]['html']
+
+    def test_json(self):
+        User.objects.get_or_create(username='clara')
+        topic = Topic(subject='Dingos', creator=self.alice)
+        topic.save()
+        first = topic.add_participant(creator=self.alice, obj=self.alice)
+        response = self.client.get(reverse('iris_topic_json', kwargs=dict(topic_id=topic.id)))
+        data = json.loads(response.content)
+        assert data['topic']['subject'] == 'Dingos'
+        assert data['participants'][0]['content']['text'] == 'alice'
+        assert data['items'][0]['content']['participant']['id'] == self.alice.id
+        #
+        # - unchanged topics answer conditional requests with 304
+        etag = response['ETag']
+        response = self.client.get(
+            reverse('iris_topic_json', kwargs=dict(topic_id=topic.id)), HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 304
+        #
+        # - new items change the ETag
+        later = topic.add_participant(creator=self.alice, obj=self.bob)
+        url = reverse('iris_items_after_json', kwargs=dict(topic_id=topic.id, after_item_id=first.id))
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 200
+        data = json.loads(response.content)
+        assert [item['id'] for item in data['items']] == [later.id]
+        assert data['more'] is False
+        #
+        # - each position has its own ETag
+        url = reverse('iris_items_after_json', kwargs=dict(topic_id=topic.id, after_item_id=later.id))
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        assert response.status_code == 200
+        assert json.loads(response.content)['items'] == []
+
+    def test_conditional_get(self):
+        User.objects.get_or_create(username='clara')
+        topic = Topic(subject='Emus', creator=self.alice)
+        topic.save()
+        topic.add_participant(creator=self.alice, obj=self.alice)
+        for url in [topic.get_absolute_url(), reverse('iris_topics')]:
+            response = self.client.get(url)
+            assert response.status_code == 200
+            assert 'Cookie' in response['Vary']
+            assert 'public' in response['Cache-Control']
+            #
+            # - unchanged pages are answered with 304, by ETag or by date
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+            assert response.status_code == 304
+            response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+            assert response.status_code == 304
+        #
+        # - new items change the fingerprint
+        etag = response['ETag']
+        topic.add_participant(creator=self.alice, obj=self.bob)
+        response = self.client.get(reverse('iris_topics'), HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 200
+
+    def test_search(self):
+        User.objects.get_or_create(username='clara')
+        from iris.example.models import Note
+        topics = []
+        for subject in ['Foxes', 'Ferrets', 'Flamingos']:
+            topic = Topic(subject=subject, creator=self.alice)
+            topic.save()
+            topics.append(topic)
+        note = topics[1].add_item(creator=self.alice, obj=Note.objects.create(text='Ferrets chase foxes.'))
+        pink = topics[2].add_item(creator=self.alice, obj=Note.objects.create(text='Flamingos are pink.'))
+        # - subjects and item content are both searched, best match first
+        page = search.search_topics(AnonymousUser(), 'foxes')
+        assert [result.topic for result in page] == [topics[0], topics[1]]
+        assert page.results[1].item == note
+        assert page.next_cursor is None
+        #
+        # - results are paginated and filtered by permission
+        page = search.search_topics(AnonymousUser(), 'foxes', per_page=1)
+        assert [result.topic for result in page] == [topics[0]]
+        assert page.next_cursor is not None
+        next_page = search.search_topics(AnonymousUser(), 'foxes', after=page.next_cursor, per_page=1)
+        assert [result.topic for result in next_page] == [topics[1]]
+        topics[1].add_participant(creator=self.alice, obj=User.objects.get(username='clara'))
+        page = search.search_topics(AnonymousUser(), 'foxes', after=page.next_cursor, per_page=1)
+        assert list(page) == []
+        #
+        # - the view renders results
+        response = self.client.get(reverse('iris_search'), dict(q='pink'))
+        assert 'Flamingos are pink.' in response.content
+        #
+        # - deleted items leave the index
+        pink.delete()
+        assert search.get_backend().search('pink') == []
+        #
+        # - an index that cannot be written does not stop posting
+        backend, search._backend = search._backend, search.SQLiteSearchBackend(path='/nonexistent/index')
+        try:
+            topics[2].add_item(creator=self.alice, obj=Note.objects.create(text='Flamingos stand.'))
+        finally:
+            search._backend = backend
+
+    def test_archive(self):
+        from iris.example.models import Note
+        topic = Topic(subject='Geckos', creator=self.alice)
+        topic.save()
+        topic.add_participant(creator=self.alice, obj=self.alice)
+        old = datetime.datetime.now() - datetime.timedelta(days=10)
+        items = []
+        for i in range(5):
+            item = Item(topic=topic, creator=self.alice, content=Note.objects.create(text=str(i)),
+                        created=old + datetime.timedelta(minutes=i))
+            item.save()
+            items.append(item)
+        # - old items move out, but the newest item and the read marker stay
+        topic.mark_read(self.alice, items[1])
+        joined = topic.items.get(content_type__model='participantjoin')
+        assert ArchivedItem.objects.archive(old + datetime.timedelta(days=1)) == 3
+        assert list(topic.items.all()) == [items[1], items[4], joined]
+        topic = Topic.objects.get(pk=topic.pk)
+        assert topic.archived_until == items[3].created
+        #
+        # - pages read archived items back in order
+        page = topic.item_page(per_page=3)
+        assert [item.id for item in page] == [joined.id, items[4].id, items[3].id]
+        page = topic.item_page(older=page.older_cursor, per_page=3)
+        assert [item.id for item in page] == [items[2].id, items[1].id, items[0].id]
+        assert not page.has_older
+        page = topic.item_page(newer=page.newer_cursor, per_page=3)
+        assert [item.id for item in page] == [joined.id, items[4].id, items[3].id]
+        assert isinstance(page.object_list[2], ArchivedItem)
+
+    def test_export_import(self):
+        topic = Topic(subject='Hedgehogs', creator=self.alice)
+        topic.save()
+        topic.add_participants(creator=self.alice, objs=[self.alice, self.bob])
+        topic.remove_participant(self.bob, self.bob)
+        stream = StringIO()
+        assert export_ndjson(stream) == 9
+        lines = stream.getvalue().splitlines()
+        items = list(Item.objects.values_list('id', 'created', 'object_id'))
+        created = Topic.objects.get().created
+        assert json.loads(lines[0])['last_item_id'] == Topic.objects.get().last_item_id
+        Topic.objects.all().delete()
+        # - an interrupted import resumes from its checkpoint
+        checkpoints = []
+        importer = Importer(checkpoint=checkpoints.append)
+        settings.BULK_BATCH_SIZE = 1
+        try:
+            assert importer.run(lines[:3]) == 3
+            assert checkpoints == [1, 2, 3]
+            # A roster cached part way through is replaced.
+            assert not Topic.objects.get().has_participant(self.alice)
+            assert Importer().run(lines, skip=checkpoints[-1]) == 6
+        finally:
+            settings.BULK_BATCH_SIZE = 500
+        topic = Topic.objects.get()
+        assert topic.created == created
+        assert topic.last_item_id == max(item[0] for item in items)
+        assert list(Item.objects.values_list('id', 'created', 'object_id')) == items
+        assert topic.has_participant(self.alice) and not topic.has_participant(self.bob)
+        assert list(Topic.objects.inbox(self.alice)) == [topic]
+
+    def test_benchmarks(self):
+        topics = benchmarks.seed(topics=2, items=6, participants=3)
+        # - six items and three joins per topic
+        assert [topic.items.count() for topic in topics] == [9, 9]
+        assert topics[1].has_participant(User.objects.get(username='bench2'))
+        report = benchmarks.run(repeat=1, startup_repeat=0)
+        assert sorted(report['scenarios']) == [
+            'item_add', 'items_after', 'topic', 'topics', 'topics_anonymous', 'with_participant']
+        assert report['scenarios']['with_participant']['queries'] == 1
+        assert report['scenarios']['topic']['process_peak_rss'] > 0
+
+    def test_query_budgets(self):
+        User.objects.get_or_create(username='clara')
+        hub.start()
+        from iris.example.models import Note
+        topic = Topic(subject='Ibexes', creator=self.alice)
+        topic.save()
+        first = topic.add_participant(creator=self.alice, obj=self.alice)
+        topic.add_participant(creator=self.alice, obj=self.bob)
+        topic.add_item(creator=self.alice, obj=Note.objects.create(text='Ibexes climb.'))
+        budgets = [
+            (views.topic, 13, topic.get_absolute_url()),
+            (views.topics, 2, reverse('iris_topics')),
+            (views.items_after, 4, reverse(
+                'iris_items_after', kwargs=dict(topic_id=topic.id, after_item_id=first.id))),
+            (views.topic_json, 11, reverse('iris_topic_json', kwargs=dict(topic_id=topic.id))),
+            (views.items_after_json, 8, reverse(
+                'iris_items_after_json', kwargs=dict(topic_id=topic.id, after_item_id=first.id))),
+            (views.items_sync, 2, '{0}?t={1}:{2}'.format(reverse('iris_items_sync'), topic.id, first.id)),
+            (views.search, 5, '{0}?q=ibexes'.format(reverse('iris_search'))),
+        ]
+        for view, budget, url in budgets:
+            with self.assertIrisQueries(view, max=budget):
+                self.client.get(url)
+        #
+        # - the queries of each request are reported in a header
+        settings.QUERY_HEADER = True
+        try:
+            response = self.client.get(topic.get_absolute_url())
+        finally:
+            settings.QUERY_HEADER = False
+        assert response[HEADER].startswith('count=')
+        assert 'iris.views.topic=' in response[HEADER]
+        #
+        # - as are those of logged in users
+        self.alice.is_superuser = True
+        self.alice.save()
+        self.login(self.alice)
+        url = reverse('iris_item_add', kwargs=dict(topic_id=topic.id, plugin_name='example.note.add'))
+        with self.assertIrisQueries(views.item_add, max=10):
+            self.client.post(url, dict(text='Ibexes leap.'))
+        posts = [
+            (views.topic_mark_read, 6, reverse('iris_topic_mark_read', kwargs=dict(topic_id=topic.id)), {}),
+            (views.topic_leave, 17, reverse('iris_topic_leave', kwargs=dict(topic_id=topic.id)), {}),
+            (views.topic_join, 17, reverse('iris_topic_join', kwargs=dict(topic_id=topic.id)), {}),
+            (views.topics_leave, 14, reverse('iris_topics_leave'), dict(topic_id=topic.id)),
+        ]
+        for view, budget, url, data in posts:
+            with self.assertIrisQueries(view, max=budget):
+                self.client.post(url, data)
+        #
+        # - streamed responses are recorded until their body has been sent
+        timeout, heartbeat = settings.STREAM_TIMEOUT, settings.STREAM_HEARTBEAT
+        settings.STREAM_TIMEOUT, settings.STREAM_HEARTBEAT = 0.05, 0.01
+        try:
+            with self.assertIrisQueries(views.items_stream, max=11) as log:
+                ''.join(self.client.get(first.get_items_stream_url()))
+        finally:
+            settings.STREAM_TIMEOUT, settings.STREAM_HEARTBEAT = timeout, heartbeat
+        assert any('iris_item' in query.sql for query in log.queries if 'iris.views.items_stream' in query.tags)
+        # - and leave no cursor instrumented, even after a request whose
+        #   response was never processed
+        middleware = QueryInstrumentationMiddleware()
+        middleware.process_request(RequestFactory().get('/'))
+        request = RequestFactory().get('/')
+        middleware.process_request(request)
+        middleware.process_response(request, HttpResponse())
+        assert not any('cursor' in connection.__dict__ for connection in connections.all())
+
+    def test_topic_counts(self):
+        from iris.example.models import Note
+        topic = Topic(subject='Jackals', creator=self.alice)
+        topic.save()
+        topic.add_participants(creator=self.alice, objs=[self.alice, self.bob])
+        note = topic.add_item(creator=self.bob, obj=Note.objects.create(text='Jackals howl.'))
+        topic.remove_participant(self.alice, self.alice)
+        # - joins, items and leaves are counted as they happen
+        counts = Topic.objects.values_list('last_item', 'item_count', 'active_participant_count')
+        leave = ParticipantLeave.objects.get()
+        last_item = Item.objects.get(object_id=leave.id, content_type__model='participantleave')
+        assert list(counts) == [(last_item.id, 4, 1)]
+        assert (topic.last_item, topic.item_count, topic.active_participant_count) == (last_item, 4, 1)
+        #
+        # - the metadata block reads them without aggregate queries, only
+        #   fetching the creators of the topic and its last item
+        topic = Topic.objects.select_related('last_item').get()
+        with self.assertNumQueries(2):
+            html = Template('{% include "iris/topic_metadata.html" %}').render(Context(dict(topic=topic)))
+        assert '4 items, 1 participant' in html
+        #
+        # - recounting repairs them
+        Topic.objects.update(last_item=note, item_count=0, active_participant_count=0)
+        Topic.objects.recount()
+        assert list(counts.all()) == [(last_item.id, 4, 1)]
+        #
+        # - so does deleting an item
+        last_item.delete()
+        assert list(counts.all()) == [(note.id, 3, 1)]
+
+    def test_plugin_registry(self):
+        from iris.plugins import ParticipantAddUserPlugin, ParticipantAddUsersPlugin
+        registry = PluginRegistry([
+            'iris.plugins.ParticipantAddUserPlugin',
+            'iris.no_such_module.Plugin',
+            'iris.plugins.ParticipantAddUsersPlugin',
+        ])
+        # - plugins load in order only as far as a lookup needs
+        assert isinstance(registry.by_name['iris.participantjoin.add.user'], ParticipantAddUserPlugin)
+        assert registry._resolved == 1
+        #
+        # - plugins that fail to load are left out
+        assert [plugin.name for plugin in registry] == [
+            'iris.participantjoin.add.user', 'iris.participantjoin.add.users']
+        #
+        # - plugins may be registered and replaced at runtime
+        class NotePlugin(ParticipantAddUserPlugin):
+            name = 'example.note.add'
+        registry.register(NotePlugin)
+        replacement = registry.register(type('Users', (ParticipantAddUsersPlugin,), {}))
+        assert registry.by_name.keys() == [
+            'iris.participantjoin.add.user', 'iris.participantjoin.add.users', 'example.note.add']
+        assert registry[1] is replacement
+        del registry.by_name['example.note.add']
+        assert 'example.note.add' not in registry.by_name
+        assert len(registry) == 2
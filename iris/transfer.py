@@ -0,0 +1,221 @@
+"""Streaming export and import of iris data as newline-delimited JSON.
+
+Each line is one record: a dict of a model's field values keyed by
+attribute name, plus ``"model"``.  Content type ids are written as
+``"app_label.model"`` so that records can move between databases.
+Primary keys are kept.
+
+Models are written in dependency order, each in keyset chunks of
+``IRIS_BULK_BATCH_SIZE`` rows, so memory use does not grow with the data.
+Item content and participants from other apps, such as users or notes,
+are referenced by id only and must be moved separately.
+"""
+import datetime
+import json
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.color import no_style
+from django.db import connection, models, transaction
+
+from iris.caching import invalidate_rosters, invalidate_topics
+from iris.conf import settings
+from iris.models import (ArchivedItem, InboxEntry, Item, Participant, ParticipantJoin,
+                         ParticipantLeave, Topic)
+
+
+def model_label(model):
+    return model._meta.app_label + '.' + model._meta.object_name.lower()
+
+
+# Participants refer to items through item_last_read, and joins and
+# leaves refer to participants, so they come after them.
+MODELS = (Topic, Item, ArchivedItem, Participant, ParticipantJoin, ParticipantLeave)
+
+MODELS_BY_LABEL = dict((model_label(model), model) for model in MODELS)
+
+DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+
+def _is_content_type(field):
+    return field.rel is not None and field.rel.to is ContentType
+
+
+def _encode(field, value):
+    if value is None:
+        return None
+    if _is_content_type(field):
+        content_type = ContentType.objects.get_for_id(value)
+        return content_type.app_label + '.' + content_type.model
+    if isinstance(field, models.DateTimeField):
+        return value.isoformat()
+    return value
+
+
+def _decode(field, value):
+    if value is None:
+        return None
+    if _is_content_type(field):
+        app_label, model = value.split('.', 1)
+        return ContentType.objects.get_by_natural_key(app_label, model).id
+    if isinstance(field, models.DateTimeField):
+        if '.' in value:
+            return datetime.datetime.strptime(value, DATETIME_FORMAT + '.%f')
+        return datetime.datetime.strptime(value, DATETIME_FORMAT)
+    return value
+
+
+def export_records():
+    """Yield a dict for every row of every exported model."""
+    batch_size = settings.BULK_BATCH_SIZE
+    for model in MODELS:
+        label = model_label(model)
+        fields = model._meta.local_fields
+        attnames = [field.attname for field in fields]
+        last_pk = None
+        while True:
+            rows = model._default_manager.order_by('pk')
+            if last_pk is not None:
+                rows = rows.filter(pk__gt=last_pk)
+            rows = list(rows.values_list(*attnames)[:batch_size])
+            if not rows:
+                break
+            for row in rows:
+                record = dict(
+                    (field.attname, _encode(field, value))
+                    for field, value in zip(fields, row)
+                )
+                record['model'] = label
+                yield record
+            last_pk = rows[-1][attnames.index(model._meta.pk.attname)]
+
+
+def export_ndjson(stream):
+    """Write every exported row to `stream` as NDJSON.  Returns the number of records."""
+    count = 0
+    for record in export_records():
+        stream.write(json.dumps(record))
+        stream.write('\n')
+        count += 1
+    return count
+
+
+class Importer(object):
+    """Imports NDJSON records in batches of ``IRIS_BULK_BATCH_SIZE``.
+
+    Each batch is created with one `bulk_create` in its own transaction,
+    skipping rows whose primary keys already exist, so an interrupted
+    import may simply be run again.  `checkpoint` is called with the
+    number of lines handled after each batch commits; pass that number as
+    `skip` to resume.
+    """
+
+    def __init__(self, checkpoint=None):
+        self.checkpoint = checkpoint
+        self.count = 0
+        self._model = None
+        self._batch = []
+
+    def run(self, lines, skip=0):
+        """Import the records in `lines` after the first `skip`.  Returns the number of rows created."""
+        batch_size = settings.BULK_BATCH_SIZE
+        number = 0
+        for number, line in enumerate(lines, 1):
+            if number <= skip or not line.strip():
+                continue
+            record = json.loads(line)
+            model = MODELS_BY_LABEL[record.pop('model')]
+            if model is not self._model or len(self._batch) >= batch_size:
+                self._flush(number - 1)
+                self._model = model
+            self._batch.append(record)
+        self._flush(number)
+        self.finish()
+        return self.count
+
+    def _flush(self, line):
+        if self._batch:
+            model = self._model
+            fields = model._meta.local_fields
+            objects = [
+                model(**dict((field.attname, _decode(field, record.get(field.attname))) for field in fields))
+                for record in self._batch
+            ]
+            if model is Topic:
+                # Items come after topics, so a topic's last item does not
+                # exist yet; `finish` recounts it.
+                for obj in objects:
+                    obj.last_item_id = None
+            # Keep exported timestamps instead of stamping them with now.
+            auto_fields = [
+                (field, field.auto_now, field.auto_now_add) for field in fields
+                if getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False)
+            ]
+            try:
+                for field, auto_now, auto_now_add in auto_fields:
+                    field.auto_now = field.auto_now_add = False
+                with transaction.commit_on_success():
+                    existing = set(model._default_manager.filter(
+                        pk__in=[obj.pk for obj in objects]).values_list('pk', flat=True))
+                    objects = [obj for obj in objects if obj.pk not in existing]
+                    model._default_manager.bulk_create(objects)
+            finally:
+                for field, auto_now, auto_now_add in auto_fields:
+                    field.auto_now, field.auto_now_add = auto_now, auto_now_add
+            if model is Topic:
+                invalidate_rosters([obj.pk for obj in objects])
+            elif model is Participant:
+                invalidate_rosters(set(obj.topic_id for obj in objects))
+            self.count += len(objects)
+            self._batch = []
+        if self.checkpoint is not None and line:
+            self.checkpoint(line)
+
+    def finish(self):
+        """Fix up what bulk_create skipped: topic summaries, inboxes and sequences."""
+        qn = connection.ops.quote_name
+        topic_table = qn(Topic._meta.db_table)
+        with transaction.commit_on_success():
+            cursor = connection.cursor()
+            # One modified fixup per topic, from its newest item.
+            cursor.execute(
+                'UPDATE {topic} SET {modified} = ('
+                'SELECT MAX({created}) FROM {item} WHERE {item}.{topic_id} = {topic}.{id}) '
+                'WHERE {modified} IS NULL OR {modified} < ('
+                'SELECT MAX({created}) FROM {item} WHERE {item}.{topic_id} = {topic}.{id})'.format(
+                    topic=topic_table,
+                    item=qn(Item._meta.db_table),
+                    modified=qn('modified'),
+                    created=qn('created'),
+                    topic_id=qn('topic_id'),
+                    id=qn('id'),
+                )
+            )
+            # Active participants without an inbox entry get one.
+            cursor.execute(
+                'INSERT INTO {entry} ({content_type_id}, {object_id}, {topic_id}, {last_modified}, {unread_count}) '
+                'SELECT p.{content_type_id}, p.{object_id}, p.{topic_id}, '
+                'COALESCE(t.{modified}, t.{created}), p.{unread_count} '
+                'FROM {participant} p INNER JOIN {topic} t ON t.{id} = p.{topic_id} '
+                'WHERE p.{is_active} = %s AND NOT EXISTS ('
+                'SELECT 1 FROM {entry} e WHERE e.{content_type_id} = p.{content_type_id} '
+                'AND e.{object_id} = p.{object_id} AND e.{topic_id} = p.{topic_id})'.format(
+                    entry=qn(InboxEntry._meta.db_table),
+                    participant=qn(Participant._meta.db_table),
+                    topic=topic_table,
+                    content_type_id=qn('content_type_id'),
+                    object_id=qn('object_id'),
+                    topic_id=qn('topic_id'),
+                    last_modified=qn('last_modified'),
+                    unread_count=qn('unread_count'),
+                    modified=qn('modified'),
+                    created=qn('created'),
+                    is_active=qn('is_active'),
+                    id=qn('id'),
+                ),
+                [True],
+            )
+            for sql in connection.ops.sequence_reset_sql(no_style(), list(MODELS)):
+                cursor.execute(sql)
+            transaction.set_dirty()
+        Topic.objects.recount()
+        invalidate_topics()
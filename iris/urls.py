@@ -10,6 +10,14 @@ urlpatterns = patterns('iris.views',
         regex=  r'^create/$',
         view=   'topic_create',
     ),
+    url(name=   'iris_search',
+        regex=  r'^search/$',
+        view=   'search',
+    ),
+    url(name=   'iris_topics_leave',
+        regex=  r'^leave/$',
+        view=   'topics_leave',
+    ),
     url(name=   'iris_topic',
         regex=  r'^(?P<topic_id>\d+)/read/$',
         view=   'topic',
@@ -18,6 +26,18 @@ urlpatterns = patterns('iris.views',
         regex=  r'^(?P<topic_id>\d+)/join/$',
         view=   'topic_join',
     ),
+    url(name=   'iris_topic_leave',
+        regex=  r'^(?P<topic_id>\d+)/leave/$',
+        view=   'topic_leave',
+    ),
+    url(name=   'iris_topic_mark_read',
+        regex=  r'^(?P<topic_id>\d+)/mark-read/$',
+        view=   'topic_mark_read',
+    ),
+    url(name=   'iris_topic_json',
+        regex=  r'^(?P<topic_id>\d+)/json/$',
+        view=   'topic_json',
+    ),
     url(name=   'iris_topic_slug',
         regex=  r'^(?P<topic_id>\d+)/read/(?P<slug>[\w_-]+)/$',
         view=   'topic',
@@ -30,4 +50,16 @@ urlpatterns = patterns('iris.views',
         regex=  r'^(?P<topic_id>\d+)/items/after/(?P<after_item_id>\d+)/$',
         view=   'items_after',
     ),
+    url(name=   'iris_items_after_json',
+        regex=  r'^(?P<topic_id>\d+)/items/after/(?P<after_item_id>\d+)/json/$',
+        view=   'items_after_json',
+    ),
+    url(name=   'iris_items_sync',
+        regex=  r'^items/sync/$',
+        view=   'items_sync',
+    ),
+    url(name=   'iris_items_stream',
+        regex=  r'^(?P<topic_id>\d+)/items/stream/(?P<after_item_id>\d+)/$',
+        view=   'items_stream',
+    ),
 )
@@ -1,24 +1,71 @@
+import datetime
+import json
+import time
+from operator import or_
+
 from django.contrib.auth.decorators import login_required
 from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
 from django.core.exceptions import PermissionDenied
-from django.http import HttpResponse
+from django.core.urlresolvers import reverse
+from django.db import models
+from django.db.models import Max, Q, Sum
+from django.http import Http404, HttpResponse
 from django.shortcuts import get_object_or_404, redirect, render_to_response
 from django.template import RequestContext
+from django.template.loader import render_to_string
 from django.utils.translation import ugettext, ugettext_lazy as _
 
+from iris.caching import topics_cache_key
 from iris.conf import settings
 from iris.forms import TopicForm
-from iris.models import Item, Topic
+from iris.hub import hub
+from iris.http import (fingerprint, is_not_modified, not_modified, patch_conditional_headers,
+                       plugin_fingerprint, user_fingerprint)
+from iris.models import ArchivedItem, InboxEntry, Item, Topic
+from iris.pagination import keyset_page
+from iris.perms import filter_viewable, has_perm, prefetch_perms
+from iris.search import search_topics
+from iris.serializers import serialize_item, serialize_participant, serialize_topic
 
 
 # --- TOPICS ---
 
 
 def topic(request, topic_id, slug=None, template_name="iris/topic.html", extra_context=None, *args, **kwargs):
+    """Render a page of a topic's items.
+
+    Responses carry an ETag covering the topic's items, what the user may
+    do with the topic and the installed plugins, and conditional requests
+    that match it are answered with 304 before anything is rendered.
+    Pages for anonymous users also carry Last-Modified and may be stored
+    by shared caches.
+    """
     extra_context = extra_context or {}
-    topic = get_object_or_404(Topic, pk=topic_id)
-    if not request.user.has_perm('iris.view_topic', topic):
+    # The metadata block shows the last item's creator.
+    topic = get_object_or_404(Topic.objects.select_related('last_item'), pk=topic_id)
+    if not has_perm(request.user, 'iris.view_topic', topic):
         raise PermissionDenied()
+    etag = fingerprint(
+        topic.get_etag(),
+        user_fingerprint(request.user, ['iris.add_to_topic', 'iris.join_topic'], topic),
+        topic.has_participant(request.user),
+        plugin_fingerprint(),
+        [plugin.user_has_perm(request.user, topic) for plugin in settings.ITEM_TYPE_PLUGINS],
+    )
+    anonymous = request.user.is_anonymous()
+    last_modified = topic.modified if anonymous else None
+    if is_not_modified(request, etag, last_modified):
+        return not_modified(etag, last_modified)
+    try:
+        item_page = topic.item_page(
+            older=request.GET.get('older'),
+            newer=request.GET.get('newer'),
+            # Only items missing from the fragment cache need these.
+            related=False,
+        )
+    except ValueError:
+        raise Http404()
     item_type_list = [
         dict(
             plugin=plugin,
@@ -29,10 +76,12 @@ def topic(request, topic_id, slug=None, template_name="iris/topic.html", extra_c
     ]
     template_context = dict(
         topic=topic,
+        item_page=item_page,
         item_type_list=item_type_list,
     )
     template_context.update(extra_context)
-    return render_to_response(template_name, template_context, RequestContext(request))
+    response = render_to_response(template_name, template_context, RequestContext(request))
+    return patch_conditional_headers(response, etag, last_modified, public=anonymous)
 
 
 def default_post_topic_create(request, topic, *args, **kwargs):
@@ -41,7 +90,7 @@ def default_post_topic_create(request, topic, *args, **kwargs):
 
 def topic_create(request, form_class=TopicForm, post_topic_create=default_post_topic_create,
                  template_name="iris/topic_create.html", extra_context=None, *args, **kwargs):
-    if not request.user.has_perm('iris.add_topic'):
+    if not has_perm(request.user, 'iris.add_topic'):
         raise PermissionDenied()
     extra_context = extra_context or {}
     if request.method == 'POST':
@@ -67,31 +116,169 @@ def topic_join(request, topic_id, *args, **kwargs):
     topic = get_object_or_404(Topic, pk=topic_id)
     destination = topic
     if request.method == 'POST':
-        if not request.user.has_perm('iris.join_topic', topic):
+        if not has_perm(request.user, 'iris.join_topic', topic):
             raise PermissionDenied()
         if not topic.has_participant(request.user):
-            destination = topic.add_participant(request.user, request.user)
+            # None if a concurrent request, e.g. a double submit, already did.
+            destination = topic.add_participant(request.user, request.user) or topic
+    url = '{0}?{1}'.format(destination.get_absolute_url(), request.GET.urlencode())
+    return redirect(url)
+
+
+def topic_leave(request, topic_id, *args, **kwargs):
+    topic = get_object_or_404(Topic, pk=topic_id)
+    destination = topic
+    if request.method == 'POST':
+        if topic.has_participant(request.user):
+            # None if a concurrent request, e.g. a double submit, already did.
+            destination = topic.remove_participant(request.user, request.user) or topic
     url = '{0}?{1}'.format(destination.get_absolute_url(), request.GET.urlencode())
     return redirect(url)
 
 
+def topics_leave(request, *args, **kwargs):
+    """Leave many topics at once.
+
+    Leaves each posted ``topic_id``, or with ``older_than`` set to a
+    ``YYYY-MM-DD`` date, every joined topic last modified before that day.
+    """
+    if request.method == 'POST' and isinstance(request.user, models.Model):
+        older_than = request.POST.get('older_than')
+        if older_than:
+            try:
+                older_than = datetime.datetime.strptime(older_than, '%Y-%m-%d')
+            except ValueError:
+                raise Http404()
+            Topic.objects.remove_participant(request.user, request.user, older_than=older_than)
+        else:
+            topic_ids = [topic_id for topic_id in request.POST.getlist('topic_id') if topic_id.isdigit()]
+            Topic.objects.remove_participant(
+                request.user, request.user, topics=Topic.objects.filter(pk__in=topic_ids))
+    url = '{0}?{1}'.format(reverse('iris_topics'), request.GET.urlencode())
+    return redirect(url)
+
+
+def topic_mark_read(request, topic_id, *args, **kwargs):
+    """Mark the topic as read by the user, up to the posted `item_id` or the latest item."""
+    topic = get_object_or_404(Topic, pk=topic_id)
+    if request.method == 'POST':
+        if not has_perm(request.user, 'iris.view_topic', topic):
+            raise PermissionDenied()
+        item = None
+        item_id = request.POST.get('item_id')
+        if item_id:
+            item = get_object_or_404(Item, pk=item_id, topic=topic)
+        if isinstance(request.user, models.Model):
+            topic.mark_read(request.user, item)
+        if request.is_ajax():
+            return HttpResponse('1', 'application/json')
+    url = '{0}?{1}'.format(topic.get_absolute_url(), request.GET.urlencode())
+    return redirect(url)
+
+
 def topics(request, template_name="iris/topics.html", form_class=TopicForm, queryset=None, queryset_fn=None, extra_context=None, *args, **kwargs):
-    """Render a list of topics.
+    """Render a page of topics, most recently modified first.
 
     Set `queryset_fn` to a function that accepts ``request, queryset, *args, **kwargs``
     if you would like to select topics other than the default `queryset`
-    which is all topics in last-modified order.
+    which is all topics.
+
+    Topics the user may not view are filtered out in SQL when the
+    authentication backends support it; see `iris.perms.filter_viewable`.
+
+    Pages are addressed by ``older`` and ``newer`` cursors.  The first page
+    of the default topic list is cached until a topic changes.
+
+    Unless `queryset_fn` is given, conditional requests are handled as in
+    `topic`, with the latest modified time of the topics and the state of
+    the user's inbox standing in for the topic.  Deleting a topic does not
+    change that fingerprint.
     """
     extra_context = extra_context or {}
+    older = request.GET.get('older')
+    newer = request.GET.get('newer')
+    cache_key = None
+    if queryset is None and queryset_fn is None and older is None and newer is None:
+        cache_key = topics_cache_key(request.user)
+    cached = cache.get(cache_key) if cache_key else None
     if queryset is None:
-        queryset = Topic.objects.order_by('modified')
-    if callable(queryset_fn):
-        queryset = queryset_fn(request, queryset, *args, **kwargs)
+        queryset = Topic.objects.all()
+    etag = last_modified = None
+    anonymous = request.user.is_anonymous()
+    if queryset_fn is None:
+        if cached is not None:
+            last_modified = cached['topics_modified']
+        else:
+            last_modified = queryset.aggregate(Max('modified'))['modified__max']
+        topics_modified = last_modified
+        inbox = None
+        if isinstance(request.user, models.Model):
+            inbox = sorted(InboxEntry.objects.filter(
+                content_type=ContentType.objects.get_for_model(request.user),
+                object_id=request.user.id,
+            ).aggregate(Max('last_modified'), Sum('unread_count')).items())
+        etag = fingerprint(
+            last_modified,
+            inbox,
+            user_fingerprint(request.user, ['iris.add_topic']),
+            plugin_fingerprint(),
+        )
+        if not anonymous:
+            last_modified = None
+        if is_not_modified(request, etag, last_modified):
+            return not_modified(etag, last_modified)
+    if cached is None:
+        if callable(queryset_fn):
+            queryset = queryset_fn(request, queryset, *args, **kwargs)
+        viewable = filter_viewable(request.user, 'iris.view_topic', queryset)
+        try:
+            topic_page = keyset_page(
+                queryset if viewable is None else viewable,
+                field='modified',
+                per_page=settings.TOPICS_PER_PAGE,
+                older=older,
+                newer=newer,
+            )
+        except ValueError:
+            raise Http404()
+        cached = dict(
+            topic_page=topic_page,
+            # When False, the template checks each topic with has_perm.
+            topic_list_viewable=viewable is not None,
+        )
+        if cache_key:
+            cached['topics_modified'] = topics_modified
+            cache.set(cache_key, cached, settings.TOPICS_CACHE_TIMEOUT)
     topic_create_form = form_class()
     template_context = dict(
-        topic_list=queryset,
+        topic_list=cached['topic_page'].object_list,
         topic_create_form=topic_create_form,
     )
+    template_context.update(cached)
+    template_context.update(extra_context)
+    response = render_to_response(template_name, template_context, RequestContext(request))
+    if etag is not None:
+        patch_conditional_headers(response, etag, last_modified, public=anonymous)
+    return response
+
+
+def search(request, template_name="iris/search.html", extra_context=None, *args, **kwargs):
+    """Render a page of the topics matching the ``q`` parameter, best first.
+
+    Pages are addressed by an ``after`` cursor into the ranked results.
+    """
+    extra_context = extra_context or {}
+    query = request.GET.get('q', '').strip()
+    search_page = None
+    if query:
+        try:
+            search_page = search_topics(request.user, query, after=request.GET.get('after'))
+        except ValueError:
+            raise Http404()
+    template_context = dict(
+        query=query,
+        search_page=search_page,
+    )
     template_context.update(extra_context)
     return render_to_response(template_name, template_context, RequestContext(request))
 
@@ -103,7 +290,7 @@ def item_add(request, topic_id, plugin_name, template_name="iris/item_add.html",
     extra_context = extra_context or {}
     topic = get_object_or_404(Topic, pk=topic_id)
     plugin = settings.ITEM_TYPE_PLUGINS_BY_NAME[plugin_name]
-    if not request.user.has_perm('iris.add_to_topic', topic):
+    if not has_perm(request.user, 'iris.add_to_topic', topic):
         raise PermissionDenied()
     if not plugin.user_has_perm(request.user, topic):
         raise PermissionDenied()
@@ -112,6 +299,8 @@ def item_add(request, topic_id, plugin_name, template_name="iris/item_add.html",
         form = form_class(request.POST, request=request, topic=topic)
         if form.is_valid():
             item = form.save()
+            if 'application/json' in request.META.get('HTTP_ACCEPT', ''):
+                return _json_response(serialize_item(item) if item else None)
             if request.is_ajax():
                 return HttpResponse('1', 'application/json')
             else:
@@ -143,9 +332,13 @@ def item_add(request, topic_id, plugin_name, template_name="iris/item_add.html",
 def items_after(request, topic_id, after_item_id, template_name="iris/items_after.html", extra_context=None, *args, **kwargs):
     extra_context = extra_context or {}
     topic = get_object_or_404(Topic, pk=topic_id)
-    if not request.user.has_perm('iris.view_topic', topic):
+    if not has_perm(request.user, 'iris.view_topic', topic):
         raise PermissionDenied()
-    after_item = get_object_or_404(Item, pk=after_item_id, topic=topic)
+    try:
+        after_item = Item.objects.get(pk=after_item_id, topic=topic)
+    except Item.DoesNotExist:
+        # Clients this far behind only catch up with the item table.
+        after_item = get_object_or_404(ArchivedItem, pk=after_item_id, topic=topic)
     item_list = topic.items.filter(created__gt=after_item.created)
     template_context = dict(
         after_item=after_item,
@@ -156,3 +349,171 @@ def items_after(request, topic_id, after_item_id, template_name="iris/items_afte
         bits = template_name.rsplit('.', 1)
         template_name = bits[0] + '_ajax.' + bits[1]
     return render_to_response(template_name, template_context, RequestContext(request))
+
+
+def items_sync(request, template_name="iris/items_sync.html", extra_context=None, *args, **kwargs):
+    """Return the items added to many topics since the client last saw them, as JSON.
+
+    Each ``t`` parameter is a ``topic_id:last_seen_item_id`` pair.  The
+    response maps the id of each viewable topic with new items to its
+    ``last_item_id`` and the rendered ``html`` of those items, newest
+    first.  Permissions are checked in one pass and the items are found
+    with a single query by item id.  At most ``IRIS_SYNC_MAX_ITEMS`` items
+    are returned; when ``more`` is true, sync again with the new ids.
+    """
+    extra_context = extra_context or {}
+    cursors = {}
+    for pair in request.GET.getlist('t')[:settings.SYNC_MAX_TOPICS]:
+        topic_id, sep, item_id = pair.partition(':')
+        if not (topic_id.isdigit() and item_id.isdigit()):
+            raise Http404()
+        cursors[int(topic_id)] = int(item_id)
+    topics = Topic.objects.filter(pk__in=cursors.keys())
+    viewable = filter_viewable(request.user, 'iris.view_topic', topics)
+    if viewable is None:
+        topics = list(topics)
+        prefetch_perms(request.user, 'iris.view_topic', topics)
+        topics = [topic for topic in topics if has_perm(request.user, 'iris.view_topic', topic)]
+    else:
+        topics = list(viewable)
+    items = []
+    if topics:
+        items = list(Item.objects.filter(reduce(or_, [
+            Q(topic=topic.id, id__gt=cursors[topic.id]) for topic in topics
+        ])).order_by('id')[:settings.SYNC_MAX_ITEMS + 1])
+    more = len(items) > settings.SYNC_MAX_ITEMS
+    items_by_topic = {}
+    for item in items[:settings.SYNC_MAX_ITEMS]:
+        items_by_topic.setdefault(item.topic_id, []).insert(0, item)
+    context_instance = RequestContext(request)
+    result = {}
+    for topic in topics:
+        item_list = items_by_topic.get(topic.id)
+        if not item_list:
+            continue
+        for item in item_list:
+            item._topic_cache = topic
+        template_context = dict(
+            topic=topic,
+            item_list=item_list,
+        )
+        template_context.update(extra_context)
+        result[topic.id] = dict(
+            last_item_id=item_list[0].id,
+            html=render_to_string(template_name, template_context, context_instance),
+        )
+    return HttpResponse(json.dumps(dict(topics=result, more=more)), 'application/json')
+
+
+def _json_response(data, etag=None):
+    response = HttpResponse(json.dumps(data), 'application/json')
+    if etag is not None:
+        patch_conditional_headers(response, etag)
+    return response
+
+
+def topic_json(request, topic_id, *args, **kwargs):
+    """Return the topic, its active participants and its latest items as JSON.
+
+    Pass the returned ``older`` cursor as the ``older`` parameter for the
+    page of items before them.  Responses carry a strong ETag from
+    `Topic.get_etag` and the cursor, and conditional requests that match it
+    are answered with 304 before anything else is fetched.
+    """
+    topic = get_object_or_404(Topic, pk=topic_id)
+    if not has_perm(request.user, 'iris.view_topic', topic):
+        raise PermissionDenied()
+    older = request.GET.get('older')
+    etag = fingerprint(topic.get_etag(), older)
+    if is_not_modified(request, etag):
+        return not_modified(etag)
+    try:
+        item_page = topic.item_page(older=older)
+    except ValueError:
+        raise Http404()
+    return _json_response(dict(
+        topic=serialize_topic(topic),
+        participants=[
+            serialize_participant(participant)
+            for participant in topic.participants.filter(is_active=True).with_content()
+        ],
+        items=[serialize_item(item) for item in item_page],
+        older=item_page.older_cursor,
+    ), etag)
+
+
+def items_after_json(request, topic_id, after_item_id, *args, **kwargs):
+    """Return up to ``IRIS_ITEMS_PER_PAGE`` items added after the given item as JSON.
+
+    Items are ordered oldest first; when ``more`` is true, ask again after
+    the last one.  Conditional requests are handled as in `topic_json`.
+    """
+    topic = get_object_or_404(Topic, pk=topic_id)
+    if not has_perm(request.user, 'iris.view_topic', topic):
+        raise PermissionDenied()
+    etag = fingerprint(topic.get_etag(), int(after_item_id))
+    if is_not_modified(request, etag):
+        return not_modified(etag)
+    items = list(topic.items.with_related().filter(
+        id__gt=after_item_id,
+    ).order_by('id')[:settings.ITEMS_PER_PAGE + 1])
+    return _json_response(dict(
+        items=[serialize_item(item) for item in items[:settings.ITEMS_PER_PAGE]],
+        more=len(items) > settings.ITEMS_PER_PAGE,
+    ), etag)
+
+
+def items_stream(request, topic_id, after_item_id, template_name="iris/items_after_ajax.html", extra_context=None, *args, **kwargs):
+    """Stream items added to the topic after the given item as Server-Sent Events.
+
+    Each event carries the rendered items as its data and the latest item id
+    as its id, so a reconnecting EventSource resumes where it left off.
+    Items already posted after that id are sent at once; after that the
+    stream waits on the in-process hub and runs no queries while no items
+    arrive.  Each stream occupies a worker thread for up to
+    ``IRIS_STREAM_TIMEOUT`` seconds.
+    """
+    extra_context = extra_context or {}
+    topic = get_object_or_404(Topic, pk=topic_id)
+    if not has_perm(request.user, 'iris.view_topic', topic):
+        raise PermissionDenied()
+    after_item_id = int(after_item_id)
+    try:
+        after_item_id = int(request.META.get('HTTP_LAST_EVENT_ID') or after_item_id)
+    except ValueError:
+        # Resume from the url instead of a malformed reconnection id.
+        pass
+    context_instance = RequestContext(request)
+    hub.start()
+
+    def events():
+        last_item_id = after_item_id
+        deadline = time.time() + settings.STREAM_TIMEOUT
+        # Ask the browser to reconnect promptly when the stream ends.
+        yield 'retry: 1000\n\n'
+        # Catch up on items the hub has not heard of, e.g. those posted
+        # while the browser was away or in another process.
+        latest_item_id = topic.items.filter(id__gt=last_item_id).aggregate(latest=Max('id'))['latest']
+        if latest_item_id is not None:
+            hub.publish(topic.id, latest_item_id)
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            latest_item_id = hub.wait(topic.id, last_item_id, min(remaining, settings.STREAM_HEARTBEAT))
+            if latest_item_id is None:
+                yield ': keep-alive\n\n'
+                continue
+            template_context = dict(
+                item_list=topic.items.filter(id__gt=last_item_id, id__lte=latest_item_id),
+            )
+            template_context.update(extra_context)
+            html = render_to_string(template_name, template_context, context_instance)
+            last_item_id = latest_item_id
+            lines = [u'id: {0}'.format(last_item_id)]
+            lines.extend(u'data: {0}'.format(line) for line in html.strip().splitlines())
+            yield '\n'.join(lines).encode('utf-8') + '\n\n'
+
+    response = HttpResponse(events(), mimetype='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    return response